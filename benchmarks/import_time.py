@@ -0,0 +1,79 @@
+"""
+Startup cost of a worker: time to import trdg.data_generator, from the
+-X importtime report of a fresh interpreter. Exits with an error when the
+import goes over the budget or loads one of the optional heavy backends.
+
+Usage: python benchmarks/import_time.py [--budget 600] [--top 10]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Only needed by -hw, the Wikipedia source or LMDB output, imported on first use
+HEAVY_MODULES = [
+    "tensorflow",
+    "matplotlib",
+    "seaborn",
+    "wikipedia",
+    "requests",
+    "lmdb",
+]
+
+
+def import_times(module: str):
+    """Return the (self, cumulative) import time in us of every module loaded"""
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker import time")
+    parser.add_argument("--module", type=str, default="trdg.data_generator")
+    parser.add_argument("--budget", type=float, default=600, help="In ms")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Keep the best run, the first one also pays for cold disk caches
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    times = min(runs, key=lambda t: t[args.module][1])
+
+    print("Slowest imports (cumulative):")
+    for name, (_, cumulative_us) in sorted(
+        times.items(), key=lambda t: t[1][1], reverse=True
+    )[: args.top]:
+        print("{:>10.1f} ms  {}".format(cumulative_us / 1000, name))
+
+    total = times[args.module][1] / 1000
+    print(
+        "import {}: {:.1f} ms (budget {:.0f} ms)".format(
+            args.module, total, args.budget
+        )
+    )
+
+    heavy = [m for m in HEAVY_MODULES if m in times]
+    if heavy:
+        sys.exit("Heavy modules imported at startup: {}".format(", ".join(heavy)))
+    if total > args.budget:
+        sys.exit("Import time is over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Throughput of the generators with workers when the images come back through
+shared memory and when they are pickled, for samples of increasing size.
+
+Usage: python benchmarks/prefetch_transport.py [--workers 4] [--count 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from trdg.generators import GeneratorFromStrings  # noqa: E402
+
+FONT = os.path.join(ROOT, "tests", "font.ttf")
+TEXT = "The quick brown fox jumps over the lazy dog"
+
+
+def throughput(size: int, workers: int, count: int, slot_bytes: int) -> float:
+    """Samples per second of a generator started with that slot size"""
+
+    generator = GeneratorFromStrings(
+        [TEXT],
+        count=count,
+        fonts=[FONT],
+        size=size,
+        background_type=1,
+        workers=workers,
+        prefetch=4 * workers,
+        slot_bytes=slot_bytes,
+    )
+    # Leave the start of the pool out
+    next(generator)
+    start = time.perf_counter()
+    for _ in generator:
+        pass
+    elapsed = time.perf_counter() - start
+    generator.prefetcher.close()
+    return (count - 1) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image transport")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 128, 256])
+    args = parser.parse_args()
+
+    print("{:>6} {:>12} {:>12} {:>8}".format("size", "pickle/s", "shm/s", "ratio"))
+    for size in args.sizes:
+        pickled = throughput(size, args.workers, args.count, 0)
+        shared = throughput(size, args.workers, args.count, 16 << 20)
+        print(
+            "{:>6} {:>12.1f} {:>12.1f} {:>8.2f}".format(
+                size, pickled, shared, shared / pickled
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
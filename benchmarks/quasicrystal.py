@@ -0,0 +1,34 @@
+"""
+Per-image latency of the quasicrystal background (background type 2)
+
+Usage: python benchmarks/quasicrystal.py [--width 256] [--repeat 20]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from trdg import background_generator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quasicrystal backgrounds")
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for height in (32, 64, 128):
+        timer = timeit.Timer(
+            lambda: background_generator.quasicrystal(height, args.width)
+        )
+        best = min(timer.repeat(repeat=args.repeat, number=1))
+        print(
+            "{}x{}: {:.2f} ms/image".format(height, args.width, best * 1000.0)
+        )
+
+
+if __name__ == "__main__":
+    main()
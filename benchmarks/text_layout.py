@@ -0,0 +1,59 @@
+"""
+Cost of laying out a 200 character line compared with rendering it
+
+Usage: python benchmarks/text_layout.py [--font tests/font.ttf] [--repeat 200]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from trdg import computer_text_generator
+from trdg.utils import get_text_height, get_text_width, load_font
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text layout")
+    parser.add_argument(
+        "--font",
+        type=str,
+        default=os.path.join(os.path.dirname(__file__), "..", "tests", "font.ttf"),
+    )
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+    text = "".join(random.choice(string.ascii_letters + " ") for _ in range(200))
+    image_font = load_font(args.font, args.size)
+    metrics = computer_text_generator.get_glyph_metrics(image_font)
+
+    def uncached_layout():
+        [get_text_width(image_font, c) for c in text]
+        [get_text_height(image_font, c) for c in text]
+
+    def cached_layout():
+        [computer_text_generator._compute_character_width(metrics, c) for c in text]
+        [metrics.height(c) for c in text]
+
+    def render():
+        computer_text_generator.generate(
+            text, args.font, "#282828", args.size, 0, 1.0, 0, False, False
+        )
+
+    for name, func in [
+        ("layout (getlength/getbbox)", uncached_layout),
+        ("layout (metrics table)", cached_layout),
+        ("full render", render),
+    ]:
+        best = min(timeit.Timer(func).repeat(repeat=args.repeat, number=1))
+        print("{}: {:.1f} us".format(name, best * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -50,7 +50,9 @@ setup(
     ],
     entry_points={
         "console_scripts": [
-            "trdg=trdg.run:main"
+            "trdg=trdg.run:main",
+            "trdg-merge-labels=trdg.merge_labels:main",
+            "trdg-fetch-wikipedia=trdg.wikipedia_cache:main",
         ],
     },
 )
@@ -2,8 +2,22 @@ import os
 import sys
 import unittest
 import subprocess
+import asyncio
+import contextlib
+import gc
 import hashlib
+import http.server
+import io
+import itertools
+import json
+import pickle
+import random
 import string
+import tarfile
+import tempfile
+import threading
+import types
+from unittest import mock
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "./trdg")))
 
@@ -12,10 +26,21 @@ try:
 except:
     pass
 
+import numpy as np
 from diffimg import diff
+from PIL import Image
 
 from trdg.data_generator import FakeTextDataGenerator
-from trdg import background_generator, computer_text_generator
+from trdg import wikipedia_cache
+from trdg.merge_labels import merge_labels
+from trdg.writers import (
+    AsyncWriter,
+    DirectoryWriter,
+    LmdbWriter,
+    LmdbWriterProcess,
+    TarShardWriter,
+)
+from trdg import background_generator, computer_text_generator, distorsion_generator
 from trdg.generators import (
     GeneratorFromDict,
     GeneratorFromRandom,
@@ -27,6 +52,16 @@ from trdg.string_generator import (
     create_strings_from_dict,
     create_strings_from_wikipedia,
     create_strings_randomly,
+    iter_strings_from_dict,
+    iter_strings_from_file,
+    iter_strings_randomly,
+)
+from trdg.utils import (
+    get_text_height,
+    get_text_width,
+    load_font,
+    mask_to_labels,
+    sample_rng,
 )
 
 
@@ -75,6 +110,116 @@ class Generators(unittest.TestCase):
         img, lbl = next(generator)
         self.assertTrue(img.size[1] == 32 and isinstance(lbl, str))
 
+    def test_generator_from_strings_next_batch(self):
+        generator = GeneratorFromStrings(["TEST TEST TEST", "TEST"], count=5)
+        batch = generator.next_batch(4)
+        self.assertTrue(len(batch) == 4 and batch[1][1] == "TEST")
+        self.assertTrue(all(img.size[1] == 32 for img, _ in batch))
+        self.assertTrue(len(generator.next_batch(4)) == 1)
+        self.assertRaises(StopIteration, generator.next_batch, 4)
+
+    def test_generator_from_strings_next_array_batch(self):
+        strings = ["TEST TEST TEST", "TEST", "AB"]
+        config = dict(count=5, fonts=["tests/font.ttf"], background_type=1)
+        images = GeneratorFromStrings(strings, **config).next_batch(3)
+        generator = GeneratorFromStrings(strings, **config)
+        batch = generator.next_array_batch(4, max_width=200, charset="ABEST ")
+
+        self.assertEqual(batch.images.shape, (4, 32, 200, 3))
+        self.assertEqual(batch.images.dtype, np.uint8)
+        for i, (image, _) in enumerate(images):
+            self.assertEqual(batch.widths[i], image.size[0])
+            self.assertTrue(
+                np.array_equal(batch.images[i, :, : image.size[0]], np.asarray(image))
+            )
+        self.assertFalse(batch.images[2, :, batch.widths[2] :].any())
+        self.assertEqual(batch.labels.shape, (4, 14))
+        self.assertEqual(list(batch.labels[2, :3]), [1, 2, 0])
+        self.assertEqual(list(batch.label_lengths), [14, 4, 2, 14])
+
+        # The buffer is reused and the last batch only holds the samples left
+        last = generator.next_array_batch(4, max_width=200)
+        self.assertIs(last.images.base, batch.images.base)
+        self.assertEqual(len(last.images), 1)
+        self.assertEqual(last.labels[0, 0], ord("T"))
+        self.assertRaises(StopIteration, generator.next_array_batch, 4, 200)
+
+    def test_array_batch_leaves_out_skipped_samples(self):
+        generate = FakeTextDataGenerator.generate
+
+        def generate_or_skip(index, *args, **kwargs):
+            # generate returns None when the text is too close to its background
+            return None if index == 2 else generate(index, *args, **kwargs)
+
+        config = dict(count=5, fonts=["tests/font.ttf"], background_type=1)
+        with mock.patch.object(FakeTextDataGenerator, "generate", generate_or_skip):
+            generator = GeneratorFromStrings(["A", "BB", "CCC"], **config)
+            batch = generator.next_array_batch(4, max_width=200)
+            self.assertEqual(len(batch.images), 3)
+            self.assertEqual(list(batch.label_lengths), [1, 3, 1])
+            self.assertFalse(batch.images[3:].any())
+
+            # The wrappers fill the rows of the skipped samples with the next ones
+            generator = GeneratorFromRandom(**config)
+            batch = generator.next_array_batch(4, max_width=200)
+            self.assertEqual(len(batch.images), 4)
+            self.assertEqual(len(batch.widths), len(batch.labels))
+            self.assertEqual(generator.generated_count, 5)
+
+    def test_generator_from_strings_with_workers(self):
+        strings = ["A", "BB", "CCC", "DDDD"]
+        generator = GeneratorFromStrings(
+            strings, count=10, fonts=["tests/font.ttf"], workers=2, prefetch=3
+        )
+        samples = list(generator)
+        self.assertEqual([lbl for _, lbl in samples], (strings * 3)[:10])
+        # Every image is rendered from its own label
+        widths = [img.size[0] for img, _ in samples]
+        self.assertEqual(widths[:4], widths[4:8])
+        self.assertTrue(widths[0] < widths[1] < widths[2] < widths[3])
+
+        # Images come through shared memory, or are pickled when they do not
+        # fit in a slot, unchanged
+        config = dict(count=2, fonts=["tests/font.ttf"], background_type=1)
+        images = [img for img, _ in GeneratorFromStrings(strings, **config)]
+        for slot_bytes in [1 << 20, 3000]:
+            generator = GeneratorFromStrings(
+                strings, workers=2, slot_bytes=slot_bytes, **config
+            )
+            for image, (prefetched, _) in zip(images, generator):
+                self.assertEqual(image.tobytes(), prefetched.tobytes())
+            self.assertEqual(generator.prefetcher._ring.slot_bytes, slot_bytes)
+        # Shared memory is off unless slot_bytes is given
+        generator = GeneratorFromStrings(strings, workers=2, **config)
+        next(generator)
+        self.assertIsNone(generator.prefetcher._ring)
+
+        # A failed sample gives its slot back, so the next ones still come
+        generator = GeneratorFromStrings(
+            strings,
+            count=6,
+            fonts=["tests/font.ttf", "tests/missing.ttf"],
+            workers=2,
+            prefetch=1,
+        )
+        labels = []
+        for _ in range(6):
+            try:
+                labels.append(next(generator)[1])
+            except OSError:
+                pass
+        self.assertEqual(labels, ["A", "CCC", "A"])
+
+        # Dropping a generator stops its workers
+        generator = GeneratorFromStrings(
+            strings, fonts=["tests/font.ttf"], workers=2, ordered=False
+        )
+        next(generator)
+        pool = generator.prefetcher._pool
+        del generator
+        gc.collect()
+        self.assertTrue(all(p.exitcode is not None for p in pool._pool))
+
     def test_generator_from_dict_stops(self):
         generator = GeneratorFromDict(count=1)
         next(generator)
@@ -96,7 +241,173 @@ class Generators(unittest.TestCase):
         self.assertRaises(StopIteration, generator.next)
 
 
+class WikipediaStub(http.server.BaseHTTPRequestHandler):
+    """Random page summaries, after an error and with disambiguation pages"""
+
+    requests = 0
+
+    def do_GET(self):
+        WikipediaStub.requests += 1
+        if self.path != "/api/rest_v1/page/random/summary":
+            self.send_error(404)
+            return
+        if WikipediaStub.requests == 1:
+            self.send_error(503)
+            return
+        extract = "Page {0} has one sentence. It is the second sentence of page {0}"
+        page = {"type": "standard", "extract": extract.format(WikipediaStub.requests)}
+        if WikipediaStub.requests % 3 == 0:
+            page = {"type": "disambiguation", "extract": "Page may refer to"}
+        body = json.dumps(page).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSession(object):
+    """
+    Session of the handwriting RNN: one step per run, finishing after
+    finish_after steps
+    """
+
+    def __init__(self, lane, finish_after):
+        self.lane = lane
+        self.finish_after = finish_after
+        self.runs = 0
+
+    def run(self, fetches, feed_dict=None):
+        if fetches == "zero_states":
+            self.steps = 0
+            return None
+        self.steps += 1
+        self.runs += 1
+        finish = 1.0 if self.steps >= self.finish_after else 0.0
+        # mu1 tells the lane and the step of a stroke apart
+        return [
+            np.zeros((1, 1)),
+            np.ones((1, 1)),
+            np.array([[self.lane * 1000 + self.steps]]),
+            np.zeros((1, 1)),
+            np.full((1, 1), 1e-3),
+            np.full((1, 1), 1e-3),
+            np.zeros((1, 1)),
+            np.array([[finish]]),
+            np.ones((1, 2)),
+            np.ones((1, 2)),
+            np.ones((1, 2)),
+        ]
+
+    def close(self):
+        pass
+
+
 class DataGenerator(unittest.TestCase):
+    def test_create_string_from_wikipedia_cache(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), WikipediaStub)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = "http://127.0.0.1:{}".format(server.server_address[1])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.dict(
+                os.environ, {"TRDG_CACHE_DIR": cache_dir, "TRDG_WIKIPEDIA_URL": url}
+            ):
+                summaries = asyncio.run(
+                    wikipedia_cache.fetch_summaries("xx", 4, backoff=0, base_url=url)
+                )
+                self.assertGreaterEqual(len(summaries), 4)
+                self.assertTrue(all(s.startswith("Page") for s in summaries))
+
+                strings = create_strings_from_wikipedia(4, 6, "xx")
+                self.assertEqual(len(set(strings)), 6)
+                self.assertTrue(all(len(s.split()) > 4 for s in strings))
+
+                # Later runs draw from the cache
+                server.shutdown()
+                server.server_close()
+                requests = WikipediaStub.requests
+                self.assertEqual(len(create_strings_from_wikipedia(4, 2, "xx")), 2)
+                self.assertEqual(WikipediaStub.requests, requests)
+                self.assertTrue(
+                    os.path.isfile(os.path.join(cache_dir, "wikipedia", "xx.txt"))
+                )
+
+    def test_wikipedia_sentence_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.dict(os.environ, {"TRDG_CACHE_DIR": cache_dir}):
+                added = wikipedia_cache.add_cached_sentences("xx", ["a", "b", "a"])
+                self.assertEqual(added, ["a", "b"])
+                # Sentences already in the cache are not written again
+                added = wikipedia_cache.add_cached_sentences("xx", ["b", "c"])
+                self.assertEqual(added, ["c"])
+                path = wikipedia_cache.sentence_cache_path("xx")
+                with open(path, encoding="utf8") as f:
+                    self.assertEqual(f.read(), "a\nb\nc\n")
+
+                # The sentences stay in memory until the file changes
+                with mock.patch("builtins.open", side_effect=AssertionError):
+                    drawn = wikipedia_cache.draw_sentences("xx", 0, 3)
+                self.assertEqual(sorted(drawn), ["a", "b", "c"])
+
+                # Beyond the cap, the oldest sentences are dropped
+                with mock.patch.object(wikipedia_cache, "MAX_CACHED_SENTENCES", 4):
+                    wikipedia_cache.add_cached_sentences("xx", ["d", "e"])
+                self.assertEqual(
+                    wikipedia_cache.load_cached_sentences("xx"), ["b", "c", "d", "e"]
+                )
+
+    def test_wikipedia_draw_beyond_the_cache_cap(self):
+        pages = itertools.count()
+
+        async def fetch_summaries(lang, count, **kwargs):
+            return [
+                "Sentence {} of page {} is long enough".format(i, next(pages))
+                for i in range(count)
+            ]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.dict(
+                os.environ, {"TRDG_CACHE_DIR": cache_dir}
+            ), mock.patch.object(
+                wikipedia_cache, "MAX_CACHED_SENTENCES", 10
+            ), mock.patch.object(
+                wikipedia_cache, "fetch_summaries", fetch_summaries
+            ):
+                strings = wikipedia_cache.draw_sentences("xx", 3, 12)
+                self.assertEqual(len(set(strings)), 12)
+                self.assertEqual(len(wikipedia_cache.load_cached_sentences("xx")), 10)
+
+                # Pages that only hold short sentences end the draw
+                with self.assertRaises(RuntimeError):
+                    wikipedia_cache.draw_sentences("xx", 20, 1)
+
+    def test_wikipedia_failed_pages_are_left_out(self):
+        calls = itertools.count()
+
+        async def fetch_summary(url, semaphore, retries, backoff, timeout):
+            call = next(calls)
+            if call % 2 == 1:
+                raise OSError("HTTP Error 404: Not Found")
+            return "Page {} has one sentence".format(call)
+
+        with mock.patch.object(wikipedia_cache, "_fetch_summary", fetch_summary):
+            summaries = asyncio.run(
+                wikipedia_cache.fetch_summaries("xx", 4, concurrency=2)
+            )
+        self.assertGreaterEqual(len(summaries), 4)
+        self.assertTrue(all(s.startswith("Page") for s in summaries))
+
+        async def fail(url, semaphore, retries, backoff, timeout):
+            raise OSError("HTTP Error 404: Not Found")
+
+        with mock.patch.object(wikipedia_cache, "_fetch_summary", fail):
+            with self.assertRaises(OSError):
+                asyncio.run(wikipedia_cache.fetch_summaries("xx", 4, concurrency=2))
+
     def test_create_string_from_wikipedia(self):
         """
             Test that the function returns different output if called twice.
@@ -119,6 +430,19 @@ class DataGenerator(unittest.TestCase):
             len(strings) == 6 and strings[0] != strings[1] and strings[0] == strings[3]
         )
 
+    def test_iter_strings_from_file_cycles(self):
+        strings = list(itertools.islice(iter_strings_from_file("tests/test.txt"), 7))
+
+        self.assertEqual(strings, create_strings_from_file("tests/test.txt", 7))
+        self.assertTrue(strings[0] == strings[3] == strings[6])
+
+    def test_iter_strings_randomly_never_stops(self):
+        strings = itertools.islice(
+            iter_strings_randomly(2, False, -1, True, False, False, "en"), 1500
+        )
+
+        self.assertTrue(all(len(s.split(" ")) == 2 for s in strings))
+
     def test_create_strings_from_dict(self):
         strings = create_strings_from_dict(
             3, False, 2, ["TEST", "TEST", "TEST", "TEST"]
@@ -126,6 +450,22 @@ class DataGenerator(unittest.TestCase):
 
         self.assertTrue(len(strings) == 2 and len(strings[0].split(" ")) == 3)
 
+    def test_strings_drawn_from_sample_rngs(self):
+        words = ["alpha", "beta", "gamma", "delta", "epsilon"]
+        strings = list(
+            iter_strings_from_dict(
+                3, True, 6, words, (sample_rng(3, i, 1) for i in range(6))
+            )
+        )
+        # A string only depends on the generator of its index
+        shard = iter_strings_from_dict(
+            3, True, 2, words, (sample_rng(3, i, 1) for i in range(4, 6))
+        )
+        self.assertEqual(list(shard), strings[4:])
+        self.assertNotEqual(
+            sample_rng(3, 4).random(), sample_rng(3, 4, 1).random()
+        )
+
     def test_multiline_text_generation(self):
         single, _ = computer_text_generator.generate(
             "TEST",
@@ -151,6 +491,177 @@ class DataGenerator(unittest.TestCase):
         )
         self.assertTrue(multi.size[1] > single.size[1])
 
+    def test_glyph_metrics_match_font(self):
+        image_font = load_font("tests/font.ttf", 32)
+        metrics = computer_text_generator.get_glyph_metrics(image_font)
+
+        self.assertTrue(
+            metrics is computer_text_generator.get_glyph_metrics(image_font)
+        )
+        for c in "TEST test":
+            self.assertEqual(metrics.width(c), get_text_width(image_font, c))
+            self.assertEqual(metrics.height(c), get_text_height(image_font, c))
+        self.assertEqual(metrics.width("TEST"), get_text_width(image_font, "TEST"))
+        self.assertEqual(
+            computer_text_generator._compute_character_width(metrics, "\u0e48"), 0
+        )
+
+    def test_generate_batch_matches_generate(self):
+        texts = ["TEST TEST TEST", "TEST", "TEST TEST"]
+        fonts = ["tests/font.ttf"] * 3
+        config = GeneratorFromStrings(
+            texts,
+            blur=2,
+            random_blur=True,
+            background_type=1,
+            skewing_angle=5,
+            random_skew=True,
+        ).generate_config()
+
+        random.seed(7)
+        images = [
+            FakeTextDataGenerator.generate(i + 3, text, font, **config)
+            for i, (text, font) in enumerate(zip(texts, fonts))
+        ]
+        random.seed(7)
+        batch = FakeTextDataGenerator.generate_batch(texts, fonts, config, 3)
+
+        self.assertEqual(
+            [img.tobytes() for img in images], [img.tobytes() for img in batch]
+        )
+
+    def test_generate_batch_with_seed_is_reproducible(self):
+        texts = ["TEST TEST TEST", "TEST", "TEST TEST"]
+        fonts = ["tests/font.ttf"] * 3
+        config = GeneratorFromStrings(
+            texts,
+            blur=2,
+            random_blur=True,
+            background_type=0,
+            distorsion_type=3,
+            skewing_angle=5,
+            random_skew=True,
+        ).generate_config()
+
+        batch = FakeTextDataGenerator.generate_batch(texts, fonts, config, seed=11)
+        last = FakeTextDataGenerator.generate_batch(
+            texts[2:], fonts[2:], config, start_index=2, seed=11
+        )
+        other_seed = FakeTextDataGenerator.generate_batch(
+            texts[2:], fonts[2:], config, start_index=2, seed=12
+        )
+
+        self.assertEqual(batch[2].tobytes(), last[0].tobytes())
+        self.assertNotEqual(batch[2].tobytes(), other_seed[0].tobytes())
+
+    def test_generate_to_tar_shards(self):
+        texts = ["TEST TEST TEST", "TEST", "TEST TEST"]
+        config = GeneratorFromStrings(texts, background_type=1).generate_config()
+        with tempfile.TemporaryDirectory() as out_dir:
+            # Small enough for every shard to hold a single sample
+            writer = TarShardWriter(out_dir, max_bytes=1, prefix="test")
+            config.update(
+                extension="jpg", output_mask=1, output_bboxes=1, writer=writer
+            )
+            FakeTextDataGenerator.generate_batch(texts, ["tests/font.ttf"] * 3, config)
+            writer.close()
+
+            self.assertEqual(len(os.listdir(out_dir)), 3)
+            with tarfile.open(writer.shard_paths[1]) as tar:
+                self.assertEqual(
+                    tar.getnames(),
+                    ["000000001.jpg", "000000001.json", "000000001.mask.png"],
+                )
+                annotation = json.load(tar.extractfile("000000001.json"))
+        self.assertEqual(annotation["label"], "TEST")
+        self.assertEqual(len(annotation["bboxes"]), 4)
+
+    def test_generate_with_async_writer(self):
+        texts = ["TEST TEST TEST", "TEST", "TEST TEST"]
+        config = GeneratorFromStrings(texts, background_type=1).generate_config()
+        config.update(extension="jpg", output_mask=1, name_format=2)
+        with tempfile.TemporaryDirectory() as out_dir:
+            writer = AsyncWriter(DirectoryWriter(out_dir), threads=2, max_pending=1)
+            config.update(writer=writer)
+            FakeTextDataGenerator.generate_batch(texts, ["tests/font.ttf"] * 3, config)
+            writer.close()
+            self.assertEqual(
+                sorted(os.listdir(out_dir)),
+                ["0.jpg", "0_mask.png", "1.jpg", "1_mask.png", "2.jpg", "2_mask.png"],
+            )
+
+            # Errors of the writing threads reach the caller, from the next
+            # write or from close
+            writer = AsyncWriter(DirectoryWriter(os.path.join(out_dir, "missing")))
+            config.update(writer=writer)
+            with self.assertRaises(FileNotFoundError):
+                try:
+                    FakeTextDataGenerator.generate_batch(
+                        texts, ["tests/font.ttf"] * 3, config
+                    )
+                finally:
+                    writer.close()
+
+    def test_generate_to_lmdb(self):
+        try:
+            import lmdb
+        except ImportError:
+            self.skipTest("lmdb is not installed")
+
+        texts = ["TEST TEST TEST", "TEST", "TEST TEST"]
+        config = GeneratorFromStrings(texts, background_type=1).generate_config()
+        with tempfile.TemporaryDirectory() as out_dir:
+            writer_process = LmdbWriterProcess(out_dir, batch_size=2, max_pending=1)
+            config.update(extension="jpg", writer=writer_process.queue_writer())
+            FakeTextDataGenerator.generate_batch(texts, ["tests/font.ttf"] * 3, config)
+            writer_process.close()
+
+            env = lmdb.open(out_dir, readonly=True)
+            with env.begin() as txn:
+                self.assertEqual(txn.get(b"num-samples"), b"3")
+                self.assertEqual(txn.get(b"label-000000002"), b"TEST")
+                image = Image.open(io.BytesIO(txn.get(b"image-000000003")))
+                self.assertEqual(image.format, "JPEG")
+            env.close()
+
+    def test_lmdb_keys_are_dense(self):
+        try:
+            import lmdb
+        except ImportError:
+            self.skipTest("lmdb is not installed")
+
+        image = Image.new("RGB", (4, 4))
+        with tempfile.TemporaryDirectory() as out_dir:
+            writer = LmdbWriter(out_dir, batch_size=2)
+            # Shards and skipped samples leave gaps in the indices
+            for index, text in [(7, "a"), (3, "b"), (12, "c")]:
+                writer.write(index, "", text, image, "png")
+            writer.close()
+
+            env = lmdb.open(out_dir, readonly=True)
+            with env.begin() as txn:
+                self.assertEqual(txn.get(b"num-samples"), b"3")
+                labels = [txn.get(b"label-%09d" % key) for key in range(1, 4)]
+                self.assertEqual(labels, [b"a", b"b", b"c"])
+            env.close()
+
+    def test_lmdb_queue_writer_fails_when_process_stops(self):
+        try:
+            import lmdb
+        except ImportError:
+            self.skipTest("lmdb is not installed")
+
+        image = Image.new("RGB", (4, 4))
+        with tempfile.TemporaryDirectory() as out_dir:
+            writer_process = LmdbWriterProcess(out_dir, max_pending=1)
+            writer_process.process.terminate()
+            writer_process.process.join()
+            writer = writer_process.queue_writer()
+            with self.assertRaises(RuntimeError):
+                # The queue fills up with nobody reading it
+                for index in range(3):
+                    writer.write(index, "", "a", image, "png")
+
     def test_generate_data_with_format(self):
         FakeTextDataGenerator.generate(
             0,
@@ -397,6 +908,157 @@ class DataGenerator(unittest.TestCase):
 
         os.remove("tests/out/TEST TEST TEST_5.jpg")
 
+    def test_random_distorsion_moves_image_and_mask_together(self):
+        img, _ = computer_text_generator.generate(
+            "TEST TEST TEST", "tests/font.ttf", "#010101", 32, 0, 1, 0, False, False
+        )
+        alpha = img.split()[3]
+        mask = Image.merge("RGB", (alpha, alpha, alpha))
+
+        distorted_img, distorted_mask = distorsion_generator.random(
+            img, mask, vertical=True, horizontal=True
+        )
+
+        self.assertTrue(distorted_img.size[0] > img.size[0])
+        self.assertTrue(distorted_img.size[1] > img.size[1])
+        self.assertEqual(
+            distorted_img.split()[3].tobytes(), distorted_mask.split()[0].tobytes()
+        )
+
+    def test_heavy_backends_are_imported_lazily(self):
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import sys, trdg.run; "
+                "print(sorted({'tensorflow', 'wikipedia'} & set(sys.modules)))",
+            ]
+        )
+        self.assertEqual(output.strip(), b"[]")
+
+    def test_handwritten_strokes_rasterization(self):
+        try:
+            from trdg import handwritten_text_generator
+        except ImportError:
+            self.skipTest("The handwritten backend needs TensorFlow")
+
+        # Two words of two characters, each character drawn as one stroke
+        coords = [[0.0, 0.0, 1.0]]
+        phi_data = []
+        for char in range(2):
+            for step in range(10):
+                coords.append([1.0, step % 2, 1.0 if step == 9 else 0.0])
+                phi_data.append(np.eye(4)[char])
+        words = [
+            handwritten_text_generator._word_points(coords, phi_data, 2) + (i * 3,)
+            for i in range(2)
+        ]
+
+        image, mask = handwritten_text_generator._rasterize(words, (1, 1, 1))
+
+        self.assertEqual(image.size, mask.size)
+        self.assertEqual(image.getpixel((0, 0))[:3], (1, 1, 1))
+        self.assertEqual(image.split()[3].getbbox(), mask.getbbox())
+        # Characters 0, 1, 3 and 4 are drawn, 2 is the space between words
+        self.assertEqual(set(np.unique(mask_to_labels(mask))), {0, 1, 2, 4, 5})
+
+    def test_handwritten_lockstep_sampling(self):
+        from trdg import handwritten_text_generator
+
+        params = handwritten_text_generator.Params(
+            *handwritten_text_generator.PARAM_FIELDS
+        )
+        translation = {" ": 0, "a": 1, "b": 2}
+        sessions = [StubSession(0, 3), StubSession(1, 5), StubSession(2, 10 ** 6)]
+        results = handwritten_text_generator._sample_texts(
+            sessions,
+            params,
+            ["ab", "a", "b"],
+            translation,
+            [np.random.RandomState(i) for i in range(3)],
+        )
+
+        # Each sequence stops on its own finish output, or after 60 steps per
+        # character, and is not run once stopped
+        self.assertEqual([len(r[4]) for r in results], [4, 6, 121])
+        self.assertEqual([s.runs for s in sessions], [3, 5, 120])
+        # Results are in the order of the texts
+        self.assertEqual([r[3][0][0] for r in results], [1, 1001, 2001])
+
+        model = handwritten_text_generator.HandwrittenModel(lanes=2)
+        model.sessions = [StubSession(0, 3), StubSession(1, 5)]
+        model.params = params
+        model.translation = translation
+        results = model.sample_batch(["ab", "a", "b"], random.Random(0))
+        self.assertEqual([len(r[4]) for r in results], [4, 6, 4])
+        self.assertEqual(model.timings().samples, 3)
+        model.close()
+
+    def test_handwritten_model_is_loaded_once(self):
+        from trdg import handwritten_text_generator
+
+        graphs = []
+
+        class StubGraph(object):
+            def __init__(self):
+                graphs.append(self)
+
+            def as_default(self):
+                return contextlib.nullcontext()
+
+            def get_collection(self, name):
+                return [name]
+
+            def finalize(self):
+                pass
+
+        class StubSaver(object):
+            def restore(self, session, path):
+                pass
+
+        def stub_session(graph=None, config=None):
+            return StubSession(0, 3)
+
+        v1 = types.SimpleNamespace(
+            ConfigProto=lambda **kwargs: None,
+            Session=stub_session,
+            train=types.SimpleNamespace(import_meta_graph=lambda path: StubSaver()),
+        )
+        tf = types.SimpleNamespace(Graph=StubGraph, compat=types.SimpleNamespace(v1=v1))
+
+        with tempfile.TemporaryDirectory() as model_dir:
+            os.mkdir(os.path.join(model_dir, "handwritten_model"))
+            with open(
+                os.path.join(model_dir, "handwritten_model", "translation.pkl"), "wb"
+            ) as f:
+                pickle.dump({" ": 0, "a": 1, "b": 2}, f)
+            with mock.patch.dict(sys.modules, {"tensorflow": tf}), mock.patch.object(
+                handwritten_text_generator,
+                "download_model_weights",
+                return_value=model_dir,
+            ), mock.patch.object(handwritten_text_generator, "_model", None):
+                handwritten_text_generator.set_model_lanes(1)
+                handwritten_text_generator.warm_up()
+                model = handwritten_text_generator.get_model()
+                # warm_up runs the session before the first sample
+                self.assertEqual(len(graphs), 1)
+                self.assertEqual(model.sessions[0].runs, 3)
+                timings = handwritten_text_generator.model_timings()
+                self.assertGreater(timings.load_time, 0)
+                self.assertEqual((timings.sample_time, timings.samples), (0, 0))
+
+                model.sample("ab", random.Random(0))
+                model.sample_batch(["a", "b"], random.Random(0))
+                self.assertIs(handwritten_text_generator.get_model(), model)
+                self.assertEqual(len(graphs), 1)
+                timings = handwritten_text_generator.model_timings()
+                self.assertGreater(timings.sample_time, 0)
+                self.assertEqual(timings.samples, 3)
+
+                model.close()
+                self.assertFalse(model.loaded)
+                self.assertEqual(model.timings(), (0.0, 0.0, 0))
+
     def test_generate_data_with_left_alignment(self):
         FakeTextDataGenerator.generate(
             6,
@@ -1282,6 +1944,78 @@ class DataGenerator(unittest.TestCase):
 
         self.assertTrue(len(bkgd.histogram()) > 20 and bkgd.size == (128, 64))
 
+    def test_generate_quasicrystal_background_in_tiles(self):
+        random.seed(42)
+        bkgd = background_generator.quasicrystal(32, 300)
+
+        tile_pixels = background_generator.QUASICRYSTAL_TILE_PIXELS
+        background_generator.QUASICRYSTAL_TILE_PIXELS = 32 * 7
+        try:
+            random.seed(42)
+            tiled_bkgd = background_generator.quasicrystal(32, 300)
+        finally:
+            background_generator.QUASICRYSTAL_TILE_PIXELS = tile_pixels
+
+        self.assertTrue(bkgd.tobytes() == tiled_bkgd.tobytes())
+
+    def test_gaussian_noise_keeps_global_random_state(self):
+        random.seed(5)
+        expected = random.random()
+        random.seed(5)
+        background_generator.gaussian_noise(4, 4)
+        self.assertEqual(random.random(), expected)
+
+    def test_gaussian_noise_atlas(self):
+        background_generator.configure_noise_atlas(height=64, width=256)
+        try:
+            atlas = background_generator._noise_atlas
+            bkgd = background_generator.gaussian_noise(32, 100)
+            texture = atlas.texture
+            wrapped = background_generator.gaussian_noise(32, 300)
+        finally:
+            background_generator.configure_noise_atlas(False)
+        pixels = np.asarray(bkgd)
+
+        self.assertTrue(bkgd.mode == "RGBA" and bkgd.size == (100, 32))
+        self.assertTrue(wrapped.size == (300, 32))
+        self.assertTrue(atlas.texture is texture)
+        self.assertTrue(abs(pixels[..., 0].mean() - 235) < 2)
+        self.assertTrue(abs(pixels[..., 0].std() - 10) < 2)
+        self.assertTrue(background_generator._noise_atlas is None)
+
+    def test_seeded_noise_atlas_depends_on_the_index(self):
+        def crop(atlas, index):
+            image = atlas.crop(8, 8, random.Random(index), index)
+            return image.tobytes(), atlas.generation
+
+        atlas = background_generator.NoiseAtlas(16, 64, refresh_every=4, seed=5)
+        expected = [crop(atlas, index) for index in range(12)]
+        # Another process renders the indices in another order
+        atlas = background_generator.NoiseAtlas(16, 64, refresh_every=4, seed=5)
+        for index in [9, 2, 11, 0, 5]:
+            self.assertEqual(crop(atlas, index), expected[index])
+        self.assertEqual(expected[9][1], 2)
+
+    def test_background_image_pool(self):
+        with tempfile.TemporaryDirectory() as image_dir:
+            for name in ["a.png", "b.png", "c.png"]:
+                Image.new("RGB", (20, 10)).save(os.path.join(image_dir, name))
+            # Room for two decoded 20x10 RGB images
+            pool = background_generator.BackgroundImagePool(image_dir, 1500)
+
+            first = pool.get("a.png")
+            self.assertTrue(pool.get("a.png") is first)
+            pool.get("b.png")
+            pool.get("c.png")
+            self.assertEqual(pool.current_bytes, 1200)
+            self.assertTrue(pool.get("a.png") is not first)
+
+            self.assertEqual(pool.crop(32, 8).size, (8, 32))
+
+            pool = background_generator.BackgroundImagePool(image_dir, max_height=5)
+            pool.prefetch()
+            self.assertEqual(pool.current_bytes, 3 * 10 * 5 * 3)
+
 
 class CommandLineInterface(unittest.TestCase):
     def test_output_dir(self):
@@ -1446,6 +2180,63 @@ class CommandLineInterface(unittest.TestCase):
         self.assertTrue(len(os.listdir("tests/out/")) == 1)
         empty_directory("tests/out/")
 
+    def test_shards_match_single_run(self):
+        common = ["python3", "run.py", "-rs", "-c", "10", "--seed", "3", "-na", "2"]
+        subprocess.Popen(
+            common + ["--output_dir", "../tests/out/"], cwd="trdg/"
+        ).wait()
+        # Shards run concurrently, as they would on several machines
+        shards = [
+            subprocess.Popen(
+                common
+                + ["--shard_index", str(i), "--shard_count", "3"]
+                + ["--output_dir", "../tests/out_2/"],
+                cwd="trdg/",
+            )
+            for i in range(3)
+        ]
+        for shard in shards:
+            shard.wait()
+        merge_labels("tests/out_2/", count=10)
+
+        for name in sorted(os.listdir("tests/out/")):
+            with open(os.path.join("tests/out/", name), "rb") as f:
+                single = f.read()
+            with open(os.path.join("tests/out_2/", name), "rb") as f:
+                self.assertEqual(single, f.read(), name)
+        self.assertEqual(len(os.listdir("tests/out_2/")), 11 + 3)
+        empty_directory("tests/out/")
+        empty_directory("tests/out_2/")
+
+    def test_worker_error_exits(self):
+        # More items than fit in flight, so the pool feeder is waiting when a
+        # worker fails
+        process = subprocess.run(
+            ["python3", "run.py", "-l", "fr", "-c", "2000", "-b", "3"]
+            + ["-id", "/nonexistent_dir", "--output_dir", "../tests/out/"],
+            cwd="trdg/",
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=120,
+        )
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn(b"FileNotFoundError", process.stderr)
+        empty_directory("tests/out/")
+
+    def test_write_error_on_exit_fails_the_run(self):
+        # The write is still pending when the worker is done with its items
+        process = subprocess.run(
+            ["python3", "run.py", "-l", "fr", "-c", "1", "-wt", "1", "-e", "xyz"]
+            + ["--output_dir", "../tests/out/"],
+            cwd="trdg/",
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=120,
+        )
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn(b"unknown file extension", process.stderr)
+        empty_directory("tests/out/")
+
     def test_personalfont(self):
         args = [
             "python3",
@@ -1,9 +1,28 @@
-from trdg.utils import font_has_glyph, filter_fonts_for_text
+import os
+import pickle
+
+import numpy as np
+from PIL import Image
+
+from trdg import utils
+from trdg.utils import (
+    font_cache_info,
+    font_has_glyph,
+    filter_fonts_for_text,
+    get_glyph_coverage,
+    load_dict,
+    load_dict_index,
+    load_font,
+    mask_to_bboxes,
+    paste_array,
+    set_font_cache_size,
+)
 
 
 def test_font_has_glyph():
     assert font_has_glyph("tests/font.ttf", "A")
     assert not font_has_glyph("tests/font.ttf", "ش")
+    assert not font_has_glyph("tests/font.ttf", "AB")
 
 
 def test_filter_fonts_for_text():
@@ -11,3 +30,85 @@ def test_filter_fonts_for_text():
     assert filter_fonts_for_text("A", fonts) == ["tests/font.ttf"]
     assert filter_fonts_for_text("ش", fonts) == ["tests/font_ar.ttf"]
     assert filter_fonts_for_text("Aش", fonts) == []
+
+
+def test_glyph_coverage_is_cached_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRDG_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utils, "_glyph_coverages", {})
+    coverage = get_glyph_coverage("tests/font.ttf")
+    assert ord("A") in coverage
+    assert len(os.listdir(tmp_path / "glyphs")) == 1
+
+    monkeypatch.setattr(utils, "_glyph_coverages", {})
+    monkeypatch.setattr(utils, "_read_glyph_coverage", None)
+    assert get_glyph_coverage("tests/font.ttf") == coverage
+
+
+def test_glyph_coverage_of_missing_font():
+    assert get_glyph_coverage("tests/missing_font.ttf") == frozenset()
+
+
+def _two_character_mask():
+    mask = np.zeros((10, 20, 3), dtype=np.uint8)
+    mask[2:5, 1:4] = (0, 0, 1)
+    # Character 2 is a space, character 3 comes after it
+    mask[3:6, 10:13] = (0, 0, 3)
+    return Image.fromarray(mask)
+
+
+def test_mask_to_bboxes():
+    assert mask_to_bboxes(_two_character_mask()) == [
+        (0, 1, 4, 5),
+        (5, 2, 8, 6),
+        (9, 2, 13, 6),
+    ]
+
+
+def test_mask_to_bboxes_tesseract():
+    assert mask_to_bboxes(_two_character_mask(), tess=True) == [
+        (0, 5, 4, 9),
+        (5, 4, 8, 9),
+        (9, 4, 13, 8),
+    ]
+
+
+def test_mask_to_bboxes_empty_mask():
+    assert mask_to_bboxes(Image.new("RGB", (20, 10))) == []
+
+
+def test_load_font_cache():
+    set_font_cache_size(1)
+    font = load_font("tests/font.ttf", 32)
+    assert load_font("tests/font.ttf", 32) is font
+    load_font("tests/font.ttf", 16)
+    assert load_font("tests/font.ttf", 32) is not font
+    info = font_cache_info()
+    assert (info.hits, info.misses, info.maxsize, info.currsize) == (1, 3, 1, 1)
+    set_font_cache_size(128)
+
+
+def test_load_dict_index(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRDG_CACHE_DIR", str(tmp_path / "cache"))
+    dict_path = tmp_path / "words.txt"
+    dict_path.write_text("alpha\n\nbêta\nгамма\n", encoding="utf8")
+
+    index = load_dict_index(str(dict_path))
+    assert list(index) == load_dict(str(dict_path)) == ["alpha", "bêta", "гамма"]
+    assert index[-1] == "гамма"
+    assert pickle.loads(pickle.dumps(index))[1] == "bêta"
+
+    # A second open maps the cached files instead of rebuilding them
+    monkeypatch.setattr(utils, "_build_dict_index", None)
+    assert list(load_dict_index(str(dict_path))) == ["alpha", "bêta", "гамма"]
+
+
+def test_paste_array_crops_wide_images():
+    out = np.full((2, 2, 4, 3), 7, dtype=np.uint8)
+    # 6 pixels wide once resized to the height of out, the aspect ratio is kept
+    image = Image.new("RGB", (3, 1), (5, 5, 5))
+    assert paste_array(image, out[0]) == 6
+    assert (out[0] == 5).all()
+
+    assert paste_array(Image.new("RGB", (1, 1), (9, 9, 9)), out[1]) == 2
+    assert (out[1, :, :2] == 9).all()
+    assert not out[1, :, 2:].any()
@@ -2,25 +2,132 @@ import cv2
 import math
 import os
 import random as rnd
+import threading
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
 from PIL import Image, ImageDraw, ImageFilter
 
+# Maximum number of pixels computed at once by quasicrystal
+QUASICRYSTAL_TILE_PIXELS = 1 << 20
 
-def gaussian_noise(height: int, width: int) -> Image:
+# Content of the image directories, with the modification time it was read at
+_image_dir_listings = {}
+
+# Settings of the background image pools of this process, see
+# configure_image_pools
+_image_pool_settings = {"max_bytes": 256 << 20, "max_height": 0, "prefetch": False}
+_image_pools = {}
+
+# Noise texture that gaussian_noise crops from when the atlas mode is on, see
+# configure_noise_atlas
+_noise_atlas = None
+
+
+def gaussian_noise(height: int, width: int, rng=rnd, index: int = None) -> Image:
     """
-    Create a background with Gaussian noise (to mimic paper)
+    Create a background with Gaussian noise (to mimic paper). index, the one
+    of the sample, picks the texture of a seeded noise atlas.
     """
 
+    if _noise_atlas is not None:
+        return _noise_atlas.crop(height, width, rng, index)
+
     # We create an all white image
     image = np.ones((height, width)) * 255
 
-    # We add gaussian noise
+    # We add gaussian noise. A per-sample rng seeds it so that it can be
+    # reproduced, the global random state is left alone otherwise
+    if rng is not rnd:
+        cv2.setRNGSeed(rng.getrandbits(31))
     cv2.randn(image, 235, 10)
 
     return Image.fromarray(image).convert("RGBA")
 
 
+class NoiseAtlas(object):
+    """
+    Large Gaussian noise texture, drawn like gaussian_noise, that backgrounds
+    are cropped from at random offsets. Crops wrap around the texture when
+    they are larger than it. With refresh_every, the texture is drawn again
+    after that many crops. With seed, the textures are the same in every
+    process, and a crop given the index of its sample uses the texture of
+    generation index // refresh_every whatever the process rendered before.
+    """
+
+    def __init__(
+        self,
+        height: int = 512,
+        width: int = 4096,
+        refresh_every: int = 0,
+        seed: int = None,
+    ):
+        self.height = height
+        self.width = width
+        self.refresh_every = refresh_every
+        self.seed = seed
+        self.texture = None
+        self.image = None
+        self.crops = 0
+        self.refreshes = 0
+        self.generation = None
+
+    def refresh(self, generation: int = None):
+        """Draw the texture again, the given generation of the seed if any"""
+        if generation is None:
+            generation = 0 if self.generation is None else self.generation + 1
+        noise = np.empty((self.height, self.width))
+        if self.seed is not None:
+            seeds = np.random.SeedSequence([self.seed, generation])
+            cv2.setRNGSeed(int(seeds.generate_state(1)[0] >> 1))
+        cv2.randn(noise, 235, 10)
+        # Same truncation to 8 bits as the per-sample conversion
+        self.texture = np.asarray(Image.fromarray(noise).convert("L"))
+        self.image = Image.fromarray(self.texture, "L").convert("RGBA")
+        self.generation = generation
+        self.crops = 0
+        self.refreshes += 1
+
+    def crop(self, height: int, width: int, rng=rnd, index: int = None) -> Image:
+        if self.seed is not None and index is not None:
+            generation = index // self.refresh_every if self.refresh_every > 0 else 0
+            if generation != self.generation:
+                self.refresh(generation)
+        elif self.texture is None or 0 < self.refresh_every <= self.crops:
+            self.refresh()
+        self.crops += 1
+
+        # Offsets keep the crop inside the texture whenever it fits
+        fits = height <= self.height and width <= self.width
+        y = rng.randint(0, self.height - (height if fits else 1))
+        x = rng.randint(0, self.width - (width if fits else 1))
+        if fits:
+            return self.image.crop((x, y, x + width, y + height))
+
+        pixels = self.texture[
+            np.arange(y, y + height)[:, None] % self.height,
+            np.arange(x, x + width)[None, :] % self.width,
+        ]
+        return Image.fromarray(pixels, "L").convert("RGBA")
+
+
+def configure_noise_atlas(
+    enabled: bool = True,
+    height: int = 512,
+    width: int = 4096,
+    refresh_every: int = 0,
+    seed: int = None,
+):
+    """
+    Switch gaussian_noise of the current process between cropping a shared
+    noise texture and drawing new noise for every background
+    """
+    global _noise_atlas
+    _noise_atlas = NoiseAtlas(height, width, refresh_every, seed) if enabled else None
+
+
 def plain_white(height: int, width: int) -> Image:
     """
     Create a plain white background
@@ -29,42 +136,142 @@ def plain_white(height: int, width: int) -> Image:
     return Image.new("L", (width, height), 255).convert("RGBA")
 
 
-def quasicrystal(height: int, width: int) -> Image:
+def quasicrystal(height: int, width: int, rng=rnd) -> Image:
     """
     Create a background with quasicrystal (https://en.wikipedia.org/wiki/Quasicrystal)
     """
 
-    image = Image.new("L", (width, height))
-    pixels = image.load()
+    frequency = rng.random() * 30 + 20  # frequency
+    phase = rng.random() * 2 * math.pi  # phase
+    rotation_count = rng.randint(10, 20)  # of rotations
 
-    frequency = rnd.random() * 30 + 20  # frequency
-    phase = rnd.random() * 2 * math.pi  # phase
-    rotation_count = rnd.randint(10, 20)  # of rotations
+    x = np.arange(height, dtype=np.float64) / (height - 1) * 4 * math.pi - 2 * math.pi
+    y = np.arange(width, dtype=np.float64) / (width - 1) * 4 * math.pi - 2 * math.pi
+
+    pixels = np.empty((height, width), dtype=np.uint8)
+
+    # Very wide images are computed in column tiles to bound the size of the
+    # temporary arrays
+    tile_width = max(1, QUASICRYSTAL_TILE_PIXELS // max(height, 1))
+    for start in range(0, width, tile_width):
+        pixels[:, start : start + tile_width] = _quasicrystal_tile(
+            x, y[start : start + tile_width], frequency, phase, rotation_count
+        )
 
-    for kw in range(width):
-        y = float(kw) / (width - 1) * 4 * math.pi - 2 * math.pi
-        for kh in range(height):
-            x = float(kh) / (height - 1) * 4 * math.pi - 2 * math.pi
-            z = 0.0
-            for i in range(rotation_count):
-                r = math.hypot(x, y)
-                a = math.atan2(y, x) + i * math.pi * 2.0 / rotation_count
-                z += math.cos(r * math.sin(a) * frequency + phase)
-            c = int(255 - round(255 * z / rotation_count))
-            pixels[kw, kh] = c  # grayscale
-    return image.convert("RGBA")
+    return Image.fromarray(pixels, "L").convert("RGBA")
 
 
-def image(height: int, width: int, image_dir: str) -> Image:
+def _quasicrystal_tile(
+    x: np.ndarray,
+    y: np.ndarray,
+    frequency: float,
+    phase: float,
+    rotation_count: int,
+) -> np.ndarray:
     """
-    Create a background with a image
+    Compute the quasicrystal field for the rows x and the columns y
     """
-    images = os.listdir(image_dir)
 
-    if len(images) > 0:
-        pic = Image.open(
-            os.path.join(image_dir, images[rnd.randint(0, len(images) - 1)])
-        )
+    xx, yy = x[:, None], y[None, :]
+    r = np.hypot(xx, yy)
+    angle = np.arctan2(yy, xx)
+
+    z = np.zeros(r.shape, dtype=np.float64)
+    for i in range(rotation_count):
+        a = angle + i * math.pi * 2.0 / rotation_count
+        z += np.cos(r * np.sin(a) * frequency + phase)
+
+    return np.clip(255 - np.round(255 * z / rotation_count), 0, 255).astype(np.uint8)
+
+
+def list_images(image_dir: str) -> List[str]:
+    """
+    List the files of an image directory, only reading it again when it changes
+    """
+    mtime = os.stat(image_dir).st_mtime_ns
+    listing = _image_dir_listings.get(image_dir)
+    if listing is None or listing[0] != mtime:
+        listing = _image_dir_listings[image_dir] = (mtime, os.listdir(image_dir))
+    return listing[1]
+
+
+class BackgroundImagePool(object):
+    """
+    Decoded images of a background directory, kept in memory up to max_bytes
+    and evicted in least recently used order. With max_height, images taller
+    than that are downscaled once when they are decoded.
+    """
+
+    def __init__(
+        self, image_dir: str, max_bytes: int = 256 << 20, max_height: int = 0
+    ):
+        self.image_dir = image_dir
+        self.max_bytes = max_bytes
+        self.max_height = max_height
+        self.current_bytes = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return list_images(self.image_dir)
+
+    def _decode(self, name: str) -> Image:
+        pic = Image.open(os.path.join(self.image_dir, name))
+        pic.load()
+        if 0 < self.max_height < pic.size[1]:
+            width = max(1, int(pic.size[0] * (self.max_height / pic.size[1])))
+            pic = pic.resize([width, self.max_height], Image.Resampling.LANCZOS)
+        return pic
+
+    def _store(self, name: str, pic: Image):
+        size = pic.size[0] * pic.size[1] * len(pic.getbands())
+        with self._lock:
+            if name in self._images or size > self.max_bytes:
+                return
+            self._images[name] = pic
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.current_bytes -= (
+                    evicted.size[0] * evicted.size[1] * len(evicted.getbands())
+                )
+
+    def get(self, name: str) -> Image:
+        """Return the decoded image of a file of the directory"""
+        with self._lock:
+            pic = self._images.get(name)
+            if pic is not None:
+                self._images.move_to_end(name)
+                return pic
+        pic = self._decode(name)
+        self._store(name, pic)
+        return pic
+
+    def prefetch(self, threads: int = 4):
+        """
+        Decode the images of the directory ahead of time, until the pool is
+        full. Decoding releases the GIL so it is spread over a few threads.
+        """
+        names = [n for n in self.names if n not in self._images]
+        with ThreadPoolExecutor(threads) as executor:
+            for start in range(0, len(names), threads):
+                if self.current_bytes >= self.max_bytes:
+                    break
+                chunk = names[start : start + threads]
+                for name, pic in zip(chunk, executor.map(self._decode, chunk)):
+                    self._store(name, pic)
+
+    def crop(self, height: int, width: int, rng=rnd) -> Image:
+        """
+        Pick a random image of the directory and crop a height x width region
+        of it, upscaling it first if it is too small
+        """
+        names = self.names
+        if len(names) == 0:
+            raise Exception("No images where found in the images folder!")
+
+        pic = self.get(names[rng.randint(0, len(names) - 1)])
 
         if pic.size[0] < width:
             pic = pic.resize(
@@ -80,12 +287,44 @@ def image(height: int, width: int, image_dir: str) -> Image:
         if pic.size[0] == width:
             x = 0
         else:
-            x = rnd.randint(0, pic.size[0] - width)
+            x = rng.randint(0, pic.size[0] - width)
         if pic.size[1] == height:
             y = 0
         else:
-            y = rnd.randint(0, pic.size[1] - height)
+            y = rng.randint(0, pic.size[1] - height)
 
         return pic.crop((x, y, x + width, y + height))
-    else:
-        raise Exception("No images where found in the images folder!")
+
+
+def configure_image_pools(
+    max_bytes: int = 256 << 20, max_height: int = 0, prefetch: bool = False
+):
+    """
+    Set the memory budget, pre-scaling height and prefetching of the
+    background image pools of the current process, existing pools are dropped
+    """
+    _image_pool_settings.update(
+        max_bytes=max_bytes, max_height=max_height, prefetch=prefetch
+    )
+    _image_pools.clear()
+
+
+def get_image_pool(image_dir: str) -> BackgroundImagePool:
+    """Return the background image pool of a directory, created on first use"""
+    pool = _image_pools.get(image_dir)
+    if pool is None:
+        pool = _image_pools[image_dir] = BackgroundImagePool(
+            image_dir,
+            _image_pool_settings["max_bytes"],
+            _image_pool_settings["max_height"],
+        )
+        if _image_pool_settings["prefetch"]:
+            pool.prefetch()
+    return pool
+
+
+def image(height: int, width: int, image_dir: str, rng=rnd) -> Image:
+    """
+    Create a background with a image
+    """
+    return get_image_pool(image_dir).crop(height, width, rng)
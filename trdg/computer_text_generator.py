@@ -1,8 +1,9 @@
 import random as rnd
+import weakref
 from typing import Tuple
 from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageFont
 
-from trdg.utils import get_text_width, get_text_height
+from trdg.utils import get_text_width, get_text_height, load_font
 
 # Thai Unicode reference: https://jrgraphix.net/r/Unicode/0E00-0E7F
 TH_TONE_MARKS = [
@@ -18,6 +19,52 @@ TH_TONE_MARKS = [
 TH_UNDER_VOWELS = ["0xe38", "0xe39", "\0xe3A"]
 TH_UPPER_VOWELS = ["0xe31", "0xe34", "0xe35", "0xe36", "0xe37"]
 
+# Code points of the Thai marks that are drawn with a width of 0
+# ("\0xe3A" is not a hexadecimal code point and has never matched)
+TH_ZERO_WIDTH_MARKS = frozenset(
+    int(c, 16)
+    for c in TH_TONE_MARKS + TH_UNDER_VOWELS + TH_UPPER_VOWELS
+    if c.startswith("0x")
+)
+
+
+class GlyphMetrics:
+    """
+    Widths and heights of the single characters of a font, filled lazily
+    """
+
+    def __init__(self, image_font: ImageFont):
+        self.image_font = image_font
+        self.widths = {}
+        self.heights = {}
+
+    def width(self, text: str) -> int:
+        if len(text) != 1:
+            return get_text_width(self.image_font, text)
+        width = self.widths.get(text)
+        if width is None:
+            width = self.widths[text] = get_text_width(self.image_font, text)
+        return width
+
+    def height(self, text: str) -> int:
+        if len(text) != 1:
+            return get_text_height(self.image_font, text)
+        height = self.heights.get(text)
+        if height is None:
+            height = self.heights[text] = get_text_height(self.image_font, text)
+        return height
+
+
+# The tables live as long as the font objects of the load_font cache
+_glyph_metrics = weakref.WeakKeyDictionary()
+
+
+def get_glyph_metrics(image_font: ImageFont) -> GlyphMetrics:
+    metrics = _glyph_metrics.get(image_font)
+    if metrics is None:
+        metrics = _glyph_metrics[image_font] = GlyphMetrics(image_font)
+    return metrics
+
 
 def generate(
     text: str,
@@ -31,6 +78,7 @@ def generate(
     word_split: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    rng=rnd,
 ) -> Tuple:
     if orientation == 0:
         return _generate_horizontal_text(
@@ -44,6 +92,7 @@ def generate(
             word_split,
             stroke_width,
             stroke_fill,
+            rng,
         )
     elif orientation == 1:
         return _generate_vertical_text(
@@ -56,19 +105,16 @@ def generate(
             fit,
             stroke_width,
             stroke_fill,
+            rng,
         )
     else:
         raise ValueError("Unknown orientation " + str(orientation))
 
 
-def _compute_character_width(image_font: ImageFont, character: str) -> int:
-    if len(character) == 1 and (
-        "{0:#x}".format(ord(character))
-        in TH_TONE_MARKS + TH_UNDER_VOWELS + TH_UNDER_VOWELS + TH_UPPER_VOWELS
-    ):
+def _compute_character_width(metrics: GlyphMetrics, character: str) -> int:
+    if len(character) == 1 and ord(character) in TH_ZERO_WIDTH_MARKS:
         return 0
-    # Casting as int to preserve the old behavior
-    return round(image_font.getlength(character))
+    return metrics.width(character)
 
 
 def _generate_horizontal_text(
@@ -82,10 +128,12 @@ def _generate_horizontal_text(
     word_split: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    rng=rnd,
 ) -> Tuple:
-    image_font = ImageFont.truetype(font=font, size=font_size)
+    image_font = load_font(font, font_size)
+    metrics = get_glyph_metrics(image_font)
 
-    space_width = int(get_text_width(image_font, " ") * space_width)
+    space_width = int(metrics.width(" ") * space_width)
 
     lines = text.replace("\\n", "\n").replace("/n", "\n").split("\n")
 
@@ -106,7 +154,7 @@ def _generate_horizontal_text(
             splitted_text = line
 
         piece_widths = [
-            _compute_character_width(image_font, p) if p != " " else space_width
+            _compute_character_width(metrics, p) if p != " " else space_width
             for p in splitted_text
         ]
 
@@ -115,9 +163,9 @@ def _generate_horizontal_text(
             text_width += character_spacing * (len(line) - 1)
 
         if splitted_text:
-            text_height = max([get_text_height(image_font, p) for p in splitted_text])
+            text_height = max([metrics.height(p) for p in splitted_text])
         else:
-            text_height = get_text_height(image_font, " ")
+            text_height = metrics.height(" ")
 
         line_splitted_text.append(splitted_text)
         line_piece_widths.append(piece_widths)
@@ -138,18 +186,18 @@ def _generate_horizontal_text(
     c1, c2 = colors[0], colors[-1]
 
     fill = (
-        rnd.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
-        rnd.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
-        rnd.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
+        rng.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
+        rng.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
+        rng.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
     )
 
     stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
     stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
 
     stroke_fill = (
-        rnd.randint(min(stroke_c1[0], stroke_c2[0]), max(stroke_c1[0], stroke_c2[0])),
-        rnd.randint(min(stroke_c1[1], stroke_c2[1]), max(stroke_c1[1], stroke_c2[1])),
-        rnd.randint(min(stroke_c1[2], stroke_c2[2]), max(stroke_c1[2], stroke_c2[2])),
+        rng.randint(min(stroke_c1[0], stroke_c2[0]), max(stroke_c1[0], stroke_c2[0])),
+        rng.randint(min(stroke_c1[1], stroke_c2[1]), max(stroke_c1[1], stroke_c2[1])),
+        rng.randint(min(stroke_c1[2], stroke_c2[2]), max(stroke_c1[2], stroke_c2[2])),
     )
 
     char_index = 0
@@ -206,15 +254,15 @@ def _generate_vertical_text(
     fit: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    rng=rnd,
 ) -> Tuple:
-    image_font = ImageFont.truetype(font=font, size=font_size)
+    image_font = load_font(font, font_size)
+    metrics = get_glyph_metrics(image_font)
 
-    space_height = int(get_text_height(image_font, " ") * space_width)
+    space_height = int(metrics.height(" ") * space_width)
 
-    char_heights = [
-        get_text_height(image_font, c) if c != " " else space_height for c in text
-    ]
-    text_width = max([get_text_width(image_font, c) for c in text])
+    char_heights = [metrics.height(c) if c != " " else space_height for c in text]
+    text_width = max([metrics.width(c) for c in text])
     text_height = sum(char_heights) + character_spacing * len(text)
 
     txt_img = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
@@ -228,23 +276,24 @@ def _generate_vertical_text(
     c1, c2 = colors[0], colors[-1]
 
     fill = (
-        rnd.randint(c1[0], c2[0]),
-        rnd.randint(c1[1], c2[1]),
-        rnd.randint(c1[2], c2[2]),
+        rng.randint(c1[0], c2[0]),
+        rng.randint(c1[1], c2[1]),
+        rng.randint(c1[2], c2[2]),
     )
 
     stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
     stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
 
     stroke_fill = (
-        rnd.randint(stroke_c1[0], stroke_c2[0]),
-        rnd.randint(stroke_c1[1], stroke_c2[1]),
-        rnd.randint(stroke_c1[2], stroke_c2[2]),
+        rng.randint(stroke_c1[0], stroke_c2[0]),
+        rng.randint(stroke_c1[1], stroke_c2[1]),
+        rng.randint(stroke_c1[2], stroke_c2[2]),
     )
 
+    y_offset = 0
     for i, c in enumerate(text):
         txt_img_draw.text(
-            (0, sum(char_heights[0:i]) + i * character_spacing),
+            (0, y_offset + i * character_spacing),
             c,
             fill=fill,
             font=image_font,
@@ -252,13 +301,14 @@ def _generate_vertical_text(
             stroke_fill=stroke_fill,
         )
         txt_mask_draw.text(
-            (0, sum(char_heights[0:i]) + i * character_spacing),
+            (0, y_offset + i * character_spacing),
             c,
             fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
             font=image_font,
             stroke_width=stroke_width,
             stroke_fill=stroke_fill,
         )
+        y_offset += char_heights[i]
 
     if fit:
         return txt_img.crop(txt_img.getbbox()), txt_mask.crop(txt_img.getbbox())
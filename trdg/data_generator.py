@@ -1,15 +1,13 @@
 import os
 import random as rnd
+from typing import List, Tuple
 
+import numpy as np
 from PIL import Image, ImageFilter, ImageStat
 
 from trdg import computer_text_generator, background_generator, distorsion_generator
-from trdg.utils import mask_to_bboxes, make_filename_valid
-
-try:
-    from trdg import handwritten_text_generator
-except ImportError as e:
-    print("Missing modules for handwritten text generation.")
+from trdg.utils import mask_to_bboxes, make_filename_valid, paste_array, sample_rng
+from trdg.writers import DirectoryWriter
 
 
 class FakeTextDataGenerator(object):
@@ -21,6 +19,82 @@ class FakeTextDataGenerator(object):
 
         cls.generate(*t)
 
+    @classmethod
+    def generate_batch(
+        cls,
+        texts: List[str],
+        fonts: List[str],
+        config: dict,
+        start_index: int = 0,
+        seed: int = None,
+    ) -> List:
+        """
+        Generate one image per (text, font) pair. config holds the other
+        arguments of generate by name and sample i is the same as
+        generate(start_index + i, texts[i], fonts[i], **config). With seed,
+        every sample draws from its own generator, see sample_rng.
+
+        This is a convenience for library users such as the generators'
+        next_batch, the CLI renders its items one at a time. The only setup
+        done once per batch is creating out_dir and loading the background
+        image pool, fonts already come from the per-process load_font cache.
+        """
+
+        if len(texts) != len(fonts):
+            raise ValueError("texts and fonts must have the same length")
+
+        if config.get("out_dir") is not None:
+            os.makedirs(config["out_dir"], exist_ok=True)
+        if config.get("background_type") not in (0, 1, 2):
+            background_generator.get_image_pool(config["image_dir"])
+
+        images = []
+        for i, (text, font) in enumerate(zip(texts, fonts)):
+            if seed is not None:
+                config = dict(config, rng=sample_rng(seed, start_index + i))
+            images.append(cls.generate(start_index + i, text, font, **config))
+        return images
+
+    @classmethod
+    def generate_array_batch(
+        cls,
+        texts: List[str],
+        fonts: List[str],
+        config: dict,
+        out: np.ndarray,
+        start_index: int = 0,
+        seed: int = None,
+    ) -> Tuple[np.ndarray, List[int]]:
+        """
+        Same as generate_batch, but every image is copied into out, an
+        N x H x W x C uint8 array, as soon as it is generated, see paste_array.
+        Samples that generate skips are left out, so the first rows of out hold
+        the images. Return their widths and the indices in texts of their
+        samples.
+        """
+
+        if len(texts) != len(fonts):
+            raise ValueError("texts and fonts must have the same length")
+        if len(texts) > len(out):
+            raise ValueError("out can only hold {} images".format(len(out)))
+        if config.get("background_type") not in (0, 1, 2):
+            background_generator.get_image_pool(config["image_dir"])
+
+        widths = np.empty(len(texts), dtype=np.int32)
+        kept = []
+        for i, (text, font) in enumerate(zip(texts, fonts)):
+            if seed is not None:
+                config = dict(config, rng=sample_rng(seed, start_index + i))
+            image = cls.generate(start_index + i, text, font, **config)
+            # Text too close to its background image
+            if image is None:
+                continue
+            if config.get("output_mask"):
+                image = image[0]
+            widths[len(kept)] = paste_array(image, out[len(kept)])
+            kept.append(i)
+        return widths[: len(kept)], kept
+
     @classmethod
     def generate(
         cls,
@@ -54,6 +128,8 @@ class FakeTextDataGenerator(object):
         stroke_fill: str = "#282828",
         image_mode: str = "RGB",
         output_bboxes: int = 0,
+        rng=rnd,
+        writer=None,
     ) -> Image:
         image = None
 
@@ -67,7 +143,10 @@ class FakeTextDataGenerator(object):
         if is_handwritten:
             if orientation == 1:
                 raise ValueError("Vertical handwritten text is unavailable")
-            image, mask = handwritten_text_generator.generate(text, text_color)
+            # Imported on first use, it pulls in TensorFlow
+            from trdg import handwritten_text_generator
+
+            image, mask = handwritten_text_generator.generate(text, text_color, rng)
         else:
             image, mask = computer_text_generator.generate(
                 text,
@@ -81,8 +160,9 @@ class FakeTextDataGenerator(object):
                 word_split,
                 stroke_width,
                 stroke_fill,
+                rng,
             )
-        random_angle = rnd.randint(0 - skewing_angle, skewing_angle)
+        random_angle = rng.randint(0 - skewing_angle, skewing_angle)
 
         rotated_img = image.rotate(
             skewing_angle if not random_skew else random_angle, expand=1
@@ -118,6 +198,7 @@ class FakeTextDataGenerator(object):
                 rotated_mask,
                 vertical=(distorsion_orientation == 0 or distorsion_orientation == 2),
                 horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2),
+                rng=rng,
             )
 
         ##################################
@@ -160,7 +241,7 @@ class FakeTextDataGenerator(object):
         #############################
         if background_type == 0:
             background_img = background_generator.gaussian_noise(
-                background_height, background_width
+                background_height, background_width, rng, index
             )
         elif background_type == 1:
             background_img = background_generator.plain_white(
@@ -168,11 +249,11 @@ class FakeTextDataGenerator(object):
             )
         elif background_type == 2:
             background_img = background_generator.quasicrystal(
-                background_height, background_width
+                background_height, background_width, rng
             )
         else:
             background_img = background_generator.image(
-                background_height, background_width, image_dir
+                background_height, background_width, image_dir, rng
             )
         background_mask = Image.new(
             "RGB", (background_width, background_height), (0, 0, 0)
@@ -240,7 +321,7 @@ class FakeTextDataGenerator(object):
         #######################
 
         gaussian_filter = ImageFilter.GaussianBlur(
-            radius=blur if not random_blur else rnd.random() * blur
+            radius=blur if not random_blur else rng.random() * blur
         )
         final_image = background_img.filter(gaussian_filter)
         final_mask = background_mask.filter(gaussian_filter)
@@ -262,28 +343,25 @@ class FakeTextDataGenerator(object):
             name = "{}_{}".format(text, str(index))
 
         name = make_filename_valid(name, allow_unicode=True)
-        image_name = "{}.{}".format(name, extension)
-        mask_name = "{}_mask.png".format(name)
-        box_name = "{}_boxes.txt".format(name)
-        tess_box_name = "{}.box".format(name)
 
         # Save the image
-        if out_dir is not None:
-            final_image.save(os.path.join(out_dir, image_name))
-            if output_mask == 1:
-                final_mask.save(os.path.join(out_dir, mask_name))
-            if output_bboxes == 1:
-                bboxes = mask_to_bboxes(final_mask)
-                with open(os.path.join(out_dir, box_name), "w") as f:
-                    for bbox in bboxes:
-                        f.write(" ".join([str(v) for v in bbox]) + "\n")
-            if output_bboxes == 2:
-                bboxes = mask_to_bboxes(final_mask, tess=True)
-                with open(os.path.join(out_dir, tess_box_name), "w") as f:
-                    for bbox, char in zip(bboxes, text):
-                        f.write(
-                            " ".join([char] + [str(v) for v in bbox] + ["0"]) + "\n"
-                        )
+        if writer is None and out_dir is not None:
+            writer = DirectoryWriter(out_dir)
+        if writer is not None:
+            writer.write(
+                index,
+                name,
+                text,
+                final_image,
+                extension,
+                mask=final_mask if output_mask == 1 else None,
+                bboxes=mask_to_bboxes(final_mask) if output_bboxes == 1 else None,
+                tess_bboxes=(
+                    mask_to_bboxes(final_mask, tess=True)
+                    if output_bboxes == 2
+                    else None
+                ),
+            )
         else:
             if output_mask == 1:
                 return final_image, final_mask
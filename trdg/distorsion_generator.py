@@ -13,6 +13,8 @@ def _apply_func_distorsion(
 ) -> Tuple:
     """
     Apply a distortion to an image
+
+    func(count) returns the offsets of the first count columns or rows
     """
 
     # Nothing to do!
@@ -23,83 +25,78 @@ def _apply_func_distorsion(
     rgb_image = image.convert("RGBA")
     rgb_mask = mask.convert("RGB")
 
-    img_arr = np.array(rgb_image)
-    mask_arr = np.array(rgb_mask)
-
-    vertical_offsets = [func(i) for i in range(img_arr.shape[1])]
-    horizontal_offsets = [
-        func(i)
-        for i in range(
-            img_arr.shape[0]
-            + (
-                (max(vertical_offsets) - min(min(vertical_offsets), 0))
-                if vertical
-                else 0
-            )
-        )
-    ]
-
-    new_img_arr = np.zeros(
-        (
-            img_arr.shape[0] + (2 * max_offset if vertical else 0),
-            img_arr.shape[1] + (2 * max_offset if horizontal else 0),
-            4,
+    img_arr = np.asarray(rgb_image)
+    mask_arr = np.asarray(rgb_mask)
+    height, width = img_arr.shape[:2]
+
+    vertical_offsets = func(width)
+    horizontal_offsets = func(
+        height
+        + (
+            (vertical_offsets.max() - min(vertical_offsets.min(), 0))
+            if vertical
+            else 0
         )
     )
 
-    new_img_arr_copy = np.copy(new_img_arr)
+    new_height = height + (2 * max_offset if vertical else 0)
+    new_width = width + (2 * max_offset if horizontal else 0)
 
-    new_mask_arr = np.zeros(
-        (
-            # I keep img_arr to maximise the chance of
-            # a breakage if img and mask don't match
-            img_arr.shape[0] + (2 * max_offset if vertical else 0),
-            img_arr.shape[1] + (2 * max_offset if horizontal else 0),
-            3,
-        )
-    )
+    # For every output pixel, find the source pixel it is copied from
+    index_type = np.int32 if (height + 1) * (width + 1) < 2**31 else np.int64
+    rows = np.arange(new_height, dtype=index_type)[:, None]
+    columns = np.arange(new_width, dtype=index_type)[None, :]
 
-    new_mask_arr_copy = np.copy(new_mask_arr)
+    if horizontal:
+        row_offsets = np.zeros(new_height, dtype=index_type)
+        row_offsets[: len(horizontal_offsets)] = horizontal_offsets
+        columns = columns - max_offset - row_offsets[:, None]
+        valid = (
+            (rows < len(horizontal_offsets)) & (columns >= 0) & (columns < width)
+        )
+        columns = np.where(valid, columns, 0)
+    else:
+        valid = np.ones((new_height, 1), dtype=bool)
 
     if vertical:
-        column_height = img_arr.shape[0]
-        for i, o in enumerate(vertical_offsets):
-            column_pos = (i + max_offset) if horizontal else i
-            new_img_arr[
-                max_offset + o : column_height + max_offset + o, column_pos, :
-            ] = img_arr[:, i, :]
-            new_mask_arr[
-                max_offset + o : column_height + max_offset + o, column_pos, :
-            ] = mask_arr[:, i, :]
+        rows = rows - max_offset - vertical_offsets.astype(index_type)[columns]
+        valid = valid & (rows >= 0) & (rows < height)
 
-    if horizontal:
-        row_width = img_arr.shape[1]
-        for i, o in enumerate(horizontal_offsets):
-            if vertical:
-                new_img_arr_copy[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = new_img_arr[i, max_offset : row_width + max_offset, :]
-                new_mask_arr_copy[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = new_mask_arr[i, max_offset : row_width + max_offset, :]
-            else:
-                new_img_arr[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = img_arr[i, :, :]
-                new_mask_arr[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = mask_arr[i, :, :]
+    # Pixels without a source point to an extra transparent pixel
+    indices = np.where(valid, rows * width + columns, height * width)
 
     return (
-        Image.fromarray(
-            np.uint8(new_img_arr_copy if horizontal and vertical else new_img_arr)
-        ).convert("RGBA"),
-        Image.fromarray(
-            np.uint8(new_mask_arr_copy if horizontal and vertical else new_mask_arr)
-        ).convert("RGB"),
+        Image.fromarray(_gather(img_arr, indices)).convert("RGBA"),
+        Image.fromarray(_gather(mask_arr, indices)).convert("RGB"),
     )
 
 
+def _gather(arr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Copy the pixels of arr at the given flat indices, index len(arr) being black
+    """
+
+    pixels = arr.reshape(-1, arr.shape[-1])
+    pixels = np.concatenate([pixels, np.zeros((1, arr.shape[-1]), dtype=arr.dtype)])
+    return np.take(pixels, indices, axis=0)
+
+
+def _trig_offsets(func, np_func, count: int, max_offset: int) -> np.ndarray:
+    """
+    Compute int(func(math.radians(x)) * max_offset) for x in range(count)
+    """
+
+    values = np_func(np.radians(np.arange(count))) * max_offset
+    offsets = np.trunc(values).astype(np.intp)
+
+    # Values too close to an integer are recomputed with math, so that they are
+    # truncated exactly like before
+    for x in np.flatnonzero(np.abs(values - np.round(values)) < 1e-6):
+        offsets[x] = int(func(math.radians(x)) * max_offset)
+
+    return offsets
+
+
 def sin(
     image: Image, mask: Image, vertical: bool = False, horizontal: bool = False
 ) -> Tuple:
@@ -115,7 +112,7 @@ def sin(
         vertical,
         horizontal,
         max_offset,
-        (lambda x: int(math.sin(math.radians(x)) * max_offset)),
+        (lambda count: _trig_offsets(math.sin, np.sin, count, max_offset)),
     )
 
 
@@ -134,12 +131,16 @@ def cos(
         vertical,
         horizontal,
         max_offset,
-        (lambda x: int(math.cos(math.radians(x)) * max_offset)),
+        (lambda count: _trig_offsets(math.cos, np.cos, count, max_offset)),
     )
 
 
 def random(
-    image: Image, mask: Image, vertical: bool = False, horizontal: bool = False
+    image: Image,
+    mask: Image,
+    vertical: bool = False,
+    horizontal: bool = False,
+    rng=rnd,
 ) -> Tuple:
     """
     Apply a random distortion on one or both of the specified axis
@@ -153,5 +154,9 @@ def random(
         vertical,
         horizontal,
         max_offset,
-        (lambda x: rnd.randint(0, max_offset)),
+        (
+            lambda count: np.array(
+                [rng.randint(0, max_offset) for _ in range(count)], dtype=np.intp
+            )
+        ),
     )
@@ -3,11 +3,13 @@ from typing import List, Tuple
 
 from trdg.generators.from_strings import GeneratorFromStrings
 from trdg.data_generator import FakeTextDataGenerator
+from trdg.generators.prefetch import prefetched_next
+from trdg.generators.wrapped import WrappedGenerator
 from trdg.string_generator import create_strings_from_dict
-from trdg.utils import load_dict, load_fonts
+from trdg.utils import load_dict_index, load_fonts
 
 
-class GeneratorFromDict:
+class GeneratorFromDict(WrappedGenerator):
     """Generator that uses words taken from pre-packaged dictionaries"""
 
     def __init__(
@@ -45,19 +47,23 @@ class GeneratorFromDict:
         output_bboxes: int = 0,
         path: str = "",
         rtl: bool = False,
+        workers: int = 0,
+        prefetch: int = 16,
+        ordered: bool = True,
+        slot_bytes: int = 0,
     ):
         self.count = count
         self.length = length
         self.allow_variable = allow_variable
 
         if path == "":
-            self.dict = load_dict(
+            self.dict = load_dict_index(
                 os.path.join(
                     os.path.dirname(__file__), "..", "dicts", language + ".txt"
                 )
             )
         else:
-            self.dict = load_dict(path)
+            self.dict = load_dict_index(path)
 
         self.batch_size = min(max(count, 1), 1000)
         self.steps_until_regeneration = self.batch_size
@@ -95,17 +101,38 @@ class GeneratorFromDict:
             output_bboxes,
             rtl,
         )
+        self.array_buffer = None
+        self.workers = workers
+        self.prefetch = prefetch
+        self.ordered = ordered
+        self.slot_bytes = slot_bytes
+        self.prefetcher = None
 
     def __iter__(self):
+        if self.workers > 0:
+            return self
         return self.generator
 
     def __next__(self):
         return self.next()
 
     def next(self):
+        if self.workers > 0:
+            return prefetched_next(self, self.generator.generate_config())
+        self._update_strings()
+        return self.generator.next()
+
+    def next_item(self) -> Tuple[int, str, str, str]:
+        """
+        Draw the next sample without rendering it, see
+        GeneratorFromStrings.next_item
+        """
+        self._update_strings()
+        return self.generator.next_item()
+
+    def _update_strings(self):
         if self.generator.generated_count >= self.steps_until_regeneration:
             self.generator.strings = create_strings_from_dict(
                 self.length, self.allow_variable, self.batch_size, self.dict
             )
             self.steps_until_regeneration += self.batch_size
-        return self.generator.next()
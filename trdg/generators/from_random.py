@@ -3,11 +3,13 @@ from typing import List, Tuple
 
 from trdg.generators.from_strings import GeneratorFromStrings
 from trdg.data_generator import FakeTextDataGenerator
+from trdg.generators.prefetch import prefetched_next
+from trdg.generators.wrapped import WrappedGenerator
 from trdg.string_generator import create_strings_randomly
 from trdg.utils import load_dict, load_fonts
 
 
-class GeneratorFromRandom:
+class GeneratorFromRandom(WrappedGenerator):
     """Generator that uses randomly generated words"""
 
     def __init__(
@@ -46,6 +48,10 @@ class GeneratorFromRandom:
         stroke_fill: str = "#282828",
         image_mode: str = "RGB",
         output_bboxes: int = 0,
+        workers: int = 0,
+        prefetch: int = 16,
+        ordered: bool = True,
+        slot_bytes: int = 0,
     ):
         self.generated_count = 0
         self.count = count
@@ -96,17 +102,42 @@ class GeneratorFromRandom:
             image_mode,
             output_bboxes,
         )
+        self.array_buffer = None
+        self.workers = workers
+        self.prefetch = prefetch
+        self.ordered = ordered
+        self.slot_bytes = slot_bytes
+        self.prefetcher = None
 
     def __iter__(self):
         return self
 
     def __next__(self):
+        if self.workers > 0:
+            # The count is checked as the samples are drawn, see next_item
+            return self.next()
         if self.generated_count == self.count:
             raise StopIteration
         self.generated_count += 1
         return self.next()
 
     def next(self):
+        if self.workers > 0:
+            return prefetched_next(self, self.generator.generate_config())
+        self._update_strings()
+        return self.generator.next()
+
+    def next_item(self) -> Tuple[int, str, str, str]:
+        """
+        Draw the next sample without rendering it, see
+        GeneratorFromStrings.next_item
+        """
+        self._update_strings()
+        item = self.generator.next_item()
+        self.generated_count += 1
+        return item
+
+    def _update_strings(self):
         if self.generator.generated_count >= self.steps_until_regeneration:
             self.generator.strings = create_strings_randomly(
                 self.length,
@@ -118,4 +149,6 @@ class GeneratorFromRandom:
                 self.language,
             )
             self.steps_until_regeneration += self.batch_size
-        return self.generator.next()
+
+    def _count_generated(self, count: int):
+        self.generated_count += count
@@ -1,8 +1,11 @@
 import os
 from typing import List, Tuple
 
+import numpy as np
+
 from trdg.data_generator import FakeTextDataGenerator
-from trdg.utils import load_dict, load_fonts
+from trdg.generators.prefetch import prefetched_next
+from trdg.utils import ArrayBatch, array_buffer, encode_labels, load_dict, load_fonts
 
 # support RTL
 from arabic_reshaper import ArabicReshaper
@@ -45,6 +48,10 @@ class GeneratorFromStrings:
         image_mode: str = "RGB",
         output_bboxes: int = 0,
         rtl: bool = False,
+        workers: int = 0,
+        prefetch: int = 16,
+        ordered: bool = True,
+        slot_bytes: int = 0,
     ):
         self.count = count
         self.strings = strings
@@ -89,6 +96,12 @@ class GeneratorFromStrings:
         self.stroke_width = stroke_width
         self.stroke_fill = stroke_fill
         self.image_mode = image_mode
+        self.array_buffer = None
+        self.workers = workers
+        self.prefetch = prefetch
+        self.ordered = ordered
+        self.slot_bytes = slot_bytes
+        self.prefetcher = None
 
     def __iter__(self):
         return self
@@ -97,46 +110,123 @@ class GeneratorFromStrings:
         return self.next()
 
     def next(self):
+        if self.workers > 0:
+            return prefetched_next(self, self.generate_config())
+        index, text, font, label = self.next_item()
+        return (
+            FakeTextDataGenerator.generate(index, text, font, **self.generate_config()),
+            label,
+        )
+
+    def next_item(self) -> Tuple[int, str, str, str]:
+        """
+        Draw the next sample without rendering it: its index, text, font and label
+        """
         if self.generated_count == self.count:
             raise StopIteration
         self.generated_count += 1
+        position = self.generated_count - 1
+        labels = self.orig_strings if self.rtl else self.strings
         return (
-            FakeTextDataGenerator.generate(
-                self.generated_count,
-                self.strings[(self.generated_count - 1) % len(self.strings)],
-                self.fonts[(self.generated_count - 1) % len(self.fonts)],
-                None,
-                self.size,
-                None,
-                self.skewing_angle,
-                self.random_skew,
-                self.blur,
-                self.random_blur,
-                self.background_type,
-                self.distorsion_type,
-                self.distorsion_orientation,
-                self.is_handwritten,
-                0,
-                self.width,
-                self.alignment,
-                self.text_color,
-                self.orientation,
-                self.space_width,
-                self.character_spacing,
-                self.margins,
-                self.fit,
-                self.output_mask,
-                self.word_split,
-                self.image_dir,
-                self.stroke_width,
-                self.stroke_fill,
-                self.image_mode,
-                self.output_bboxes,
-            ),
-            self.orig_strings[(self.generated_count - 1) % len(self.orig_strings)]
-            if self.rtl
-            else self.strings[(self.generated_count - 1) % len(self.strings)],
+            self.generated_count,
+            self.strings[position % len(self.strings)],
+            self.fonts[position % len(self.fonts)],
+            labels[position % len(labels)],
+        )
+
+    def next_batch(self, batch_size: int) -> List[Tuple]:
+        """
+        Generate up to batch_size samples at once (fewer if count is reached)
+        """
+        if self.generated_count == self.count:
+            raise StopIteration
+        if self.count >= 0:
+            batch_size = min(batch_size, self.count - self.generated_count)
+        positions = range(self.generated_count, self.generated_count + batch_size)
+        images = FakeTextDataGenerator.generate_batch(
+            [self.strings[i % len(self.strings)] for i in positions],
+            [self.fonts[i % len(self.fonts)] for i in positions],
+            self.generate_config(),
+            start_index=self.generated_count + 1,
         )
+        self.generated_count += batch_size
+        labels = self.orig_strings if self.rtl else self.strings
+        return [(image, labels[i % len(labels)]) for image, i in zip(images, positions)]
+
+    def fill_array_batch(self, out: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+        """
+        Generate up to len(out) samples directly into out, an N x size x W x C
+        uint8 array (fewer if count is reached or samples are skipped, see
+        generate_array_batch). Return their widths and labels.
+        """
+        if self.orientation != 0:
+            raise ValueError("Only horizontal text has a fixed height")
+        if self.generated_count == self.count:
+            raise StopIteration
+        batch_size = len(out)
+        if self.count >= 0:
+            batch_size = min(batch_size, self.count - self.generated_count)
+        positions = range(self.generated_count, self.generated_count + batch_size)
+        widths, kept = FakeTextDataGenerator.generate_array_batch(
+            [self.strings[i % len(self.strings)] for i in positions],
+            [self.fonts[i % len(self.fonts)] for i in positions],
+            self.generate_config(),
+            out,
+            start_index=self.generated_count + 1,
+        )
+        self.generated_count += batch_size
+        labels = self.orig_strings if self.rtl else self.strings
+        return widths, [labels[positions[i] % len(labels)] for i in kept]
+
+    def next_array_batch(
+        self, batch_size: int, max_width: int, charset: str = None
+    ) -> ArrayBatch:
+        """
+        Generate up to batch_size samples at once as arrays for a training loop,
+        see ArrayBatch and encode_labels. The images are written into a buffer
+        of the generator that the next call reuses, copy them to keep them.
+        """
+        self.array_buffer = array_buffer(
+            self.array_buffer, batch_size, self.size, max_width, self.image_mode
+        )
+        widths, labels = self.fill_array_batch(self.array_buffer)
+        return ArrayBatch(
+            self.array_buffer[: len(widths)], widths, *encode_labels(labels, charset)
+        )
+
+    def generate_config(self) -> dict:
+        """
+        Arguments of FakeTextDataGenerator.generate shared by all samples
+        """
+        return {
+            "out_dir": None,
+            "size": self.size,
+            "extension": None,
+            "skewing_angle": self.skewing_angle,
+            "random_skew": self.random_skew,
+            "blur": self.blur,
+            "random_blur": self.random_blur,
+            "background_type": self.background_type,
+            "distorsion_type": self.distorsion_type,
+            "distorsion_orientation": self.distorsion_orientation,
+            "is_handwritten": self.is_handwritten,
+            "name_format": 0,
+            "width": self.width,
+            "alignment": self.alignment,
+            "text_color": self.text_color,
+            "orientation": self.orientation,
+            "space_width": self.space_width,
+            "character_spacing": self.character_spacing,
+            "margins": self.margins,
+            "fit": self.fit,
+            "output_mask": self.output_mask,
+            "word_split": self.word_split,
+            "image_dir": self.image_dir,
+            "stroke_width": self.stroke_width,
+            "stroke_fill": self.stroke_fill,
+            "image_mode": self.image_mode,
+            "output_bboxes": self.output_bboxes,
+        }
 
     def reshape_rtl(self, strings: list, rtl_shaper: ArabicReshaper):
         # reshape RTL characters before generating any image
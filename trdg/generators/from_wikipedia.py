@@ -3,11 +3,13 @@ from typing import List, Tuple
 
 from trdg.generators.from_strings import GeneratorFromStrings
 from trdg.data_generator import FakeTextDataGenerator
+from trdg.generators.prefetch import prefetched_next
+from trdg.generators.wrapped import WrappedGenerator
 from trdg.string_generator import create_strings_from_wikipedia
 from trdg.utils import load_dict, load_fonts
 
 
-class GeneratorFromWikipedia:
+class GeneratorFromWikipedia(WrappedGenerator):
     """Generator that uses sentences taken from random Wikipedia articles"""
 
     def __init__(
@@ -43,6 +45,10 @@ class GeneratorFromWikipedia:
         image_mode: str = "RGB",
         output_bboxes: int = 0,
         rtl: bool = False,
+        workers: int = 0,
+        prefetch: int = 16,
+        ordered: bool = True,
+        slot_bytes: int = 0,
     ):
         self.generated_count = 0
         self.count = count
@@ -85,17 +91,42 @@ class GeneratorFromWikipedia:
             output_bboxes,
             rtl,
         )
+        self.array_buffer = None
+        self.workers = workers
+        self.prefetch = prefetch
+        self.ordered = ordered
+        self.slot_bytes = slot_bytes
+        self.prefetcher = None
 
     def __iter__(self):
         return self
 
     def __next__(self):
+        if self.workers > 0:
+            # The count is checked as the samples are drawn, see next_item
+            return self.next()
         if self.generated_count == self.count:
             raise StopIteration
         self.generated_count += 1
         return self.next()
 
     def next(self):
+        if self.workers > 0:
+            return prefetched_next(self, self.generator.generate_config())
+        self._update_strings()
+        return self.generator.next()
+
+    def next_item(self) -> Tuple[int, str, str, str]:
+        """
+        Draw the next sample without rendering it, see
+        GeneratorFromStrings.next_item
+        """
+        self._update_strings()
+        item = self.generator.next_item()
+        self.generated_count += 1
+        return item
+
+    def _update_strings(self):
         if self.generator.generated_count >= self.steps_until_regeneration:
             new_strings = create_strings_from_wikipedia(
                 self.minimum_length, self.batch_size, self.language
@@ -108,4 +139,6 @@ class GeneratorFromWikipedia:
             else:
                 self.generator.strings = new_strings
             self.steps_until_regeneration += self.batch_size
-        return self.generator.next()
+
+    def _count_generated(self, count: int):
+        self.generated_count += count
@@ -0,0 +1,221 @@
+"""
+Render the samples of a generator in a pool of processes, ahead of the consumer
+"""
+
+import collections
+import random
+import threading
+import weakref
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+from trdg.data_generator import FakeTextDataGenerator
+from trdg.utils import iterate_bounded
+
+_worker_config = None
+_worker_ring = None
+
+
+class SharedImageRing(object):
+    """
+    Fixed size slots in one shared memory block. A worker writes the pixels of
+    an image into a slot, and only a descriptor of the image is sent to the
+    process reading it. Slots are handed out by the reading process.
+    """
+
+    def __init__(self, slots: int, slot_bytes: int, name: str = None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        if name is None:
+            self.shm = SharedMemory(create=True, size=slots * slot_bytes)
+        else:
+            self.shm = SharedMemory(name=name)
+
+    def write(self, slot: int, image: Image) -> Tuple[int, str, Tuple[int, int], int]:
+        """
+        Copy image into slot and return its (slot, mode, size, length)
+        descriptor, or None if it does not fit
+        """
+        data = image.tobytes()
+        if len(data) > self.slot_bytes:
+            return None
+        start = slot * self.slot_bytes
+        self.shm.buf[start : start + len(data)] = data
+        return slot, image.mode, image.size, len(data)
+
+    def read(self, descriptor: Tuple[int, str, Tuple[int, int], int]) -> Image:
+        """Copy the image of a descriptor returned by write out of its slot"""
+        slot, mode, size, length = descriptor
+        start = slot * self.slot_bytes
+        return Image.frombytes(mode, size, bytes(self.shm.buf[start : start + length]))
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _init_worker(config: dict, ring_name: str, slots: int, slot_bytes: int):
+    global _worker_config, _worker_ring
+    _worker_config = config
+    if ring_name is not None:
+        _worker_ring = SharedImageRing(slots, slot_bytes, ring_name)
+    # Forked workers start with the random state of their parent
+    random.seed()
+    np.random.seed()
+
+
+def _render_item(item):
+    """
+    Render an item, return its slot, the descriptor of the image in the slot
+    or None, the image itself if it is not in the slot, and its label. The
+    error of a failed item takes the place of its image, so that its slot
+    still comes back.
+    """
+    index, text, font, label, slot = item
+    try:
+        image = FakeTextDataGenerator.generate(index, text, font, **_worker_config)
+    except Exception as e:
+        return slot, None, e, label
+    if _worker_ring is not None and isinstance(image, Image.Image):
+        descriptor = _worker_ring.write(slot, image)
+        if descriptor is not None:
+            return slot, descriptor, None, label
+    return slot, None, image, label
+
+
+def _draw_items(next_item_ref, closed: threading.Event):
+    """
+    Yield the items of a generator while it is alive. Only a weak reference is
+    kept, so that dropping the generator stops the pool.
+    """
+    while not closed.is_set():
+        next_item = next_item_ref()
+        if next_item is None:
+            return
+        try:
+            item = next_item()
+        except StopIteration:
+            return
+        del next_item
+        yield item
+
+
+def _assign_slots(items, free_slots: collections.deque, closed: threading.Event):
+    """Add a free slot to every item"""
+    for item in items:
+        if closed.is_set():
+            return
+        yield item + (free_slots.popleft(),)
+
+
+class PrefetchIterator(object):
+    """
+    Iterate over the (image, label) samples of a generator, see next_item,
+    rendered by workers processes with up to prefetch samples in flight. The
+    samples are in the order of their items unless ordered is False.
+
+    With slot_bytes, every sample in flight has a slot of that size in a
+    SharedImageRing, that its image is copied through instead of being
+    pickled. Larger images, and samples with a mask, are still pickled. It is
+    off by default, as it only pays off for large images.
+    """
+
+    def __init__(
+        self,
+        generator,
+        config: dict,
+        workers: int,
+        prefetch: int,
+        ordered: bool,
+        slot_bytes: int = 0,
+    ):
+        prefetch = max(prefetch, 1)
+        self._closed = threading.Event()
+        self._pending = threading.Semaphore(prefetch)
+        self._ring = None
+        if slot_bytes > 0:
+            self._ring = SharedImageRing(prefetch, slot_bytes)
+        # Only prefetch samples are in flight, so there is always a free slot
+        self._free_slots = collections.deque(range(prefetch))
+        self._pool = Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(
+                config,
+                self._ring.shm.name if self._ring is not None else None,
+                prefetch,
+                slot_bytes,
+            ),
+        )
+        items = _assign_slots(
+            iterate_bounded(
+                _draw_items(weakref.WeakMethod(generator.next_item), self._closed),
+                self._pending,
+            ),
+            self._free_slots,
+            self._closed,
+        )
+        imap = self._pool.imap if ordered else self._pool.imap_unordered
+        self._results = imap(_render_item, items)
+        # Also stop the workers when the generator is dropped
+        self._finalizer = weakref.finalize(
+            generator,
+            PrefetchIterator._stop,
+            self._pool,
+            self._ring,
+            self._closed,
+            self._pending,
+        )
+
+    @staticmethod
+    def _stop(pool, ring, closed: threading.Event, pending: threading.Semaphore):
+        closed.set()
+        # Wake up the thread feeding the pool if it waits for a free slot
+        pending.release()
+        pool.terminate()
+        pool.join()
+        if ring is not None:
+            ring.close()
+            ring.unlink()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed.is_set():
+            raise StopIteration
+        slot, descriptor, image, label = self._results.next()
+        if descriptor is not None:
+            image = self._ring.read(descriptor)
+        self._free_slots.append(slot)
+        self._pending.release()
+        if isinstance(image, Exception):
+            raise image
+        return image, label
+
+    def close(self):
+        """Stop the workers, the samples in flight are dropped"""
+        self._finalizer()
+
+
+def prefetched_next(generator, config: dict):
+    """
+    Next sample of a generator with workers, rendered by its PrefetchIterator
+    which is started on the first call
+    """
+    if generator.prefetcher is None:
+        generator.prefetcher = PrefetchIterator(
+            generator,
+            config,
+            generator.workers,
+            generator.prefetch,
+            generator.ordered,
+            generator.slot_bytes,
+        )
+    return next(generator.prefetcher)
@@ -0,0 +1,86 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from trdg.utils import ArrayBatch, array_buffer, encode_labels
+
+
+class WrappedGenerator(object):
+    """
+    Batch methods of the generators that render their strings with a
+    GeneratorFromStrings, self.generator, and give it new strings every
+    steps_until_regeneration samples, see _update_strings
+    """
+
+    def _update_strings(self):
+        raise NotImplementedError
+
+    def _count_generated(self, count: int):
+        """Called with the number of samples drawn by a batch"""
+
+    def _part_size(self, size: int) -> int:
+        """Samples of a batch of size that the current strings can generate"""
+        self._update_strings()
+        return min(
+            size, self.steps_until_regeneration - self.generator.generated_count
+        )
+
+    def next_batch(self, batch_size: int) -> List[Tuple]:
+        """
+        Generate up to batch_size samples at once (fewer if count is reached)
+        """
+        start = self.generator.generated_count
+        samples = []
+        while len(samples) < batch_size:
+            part_size = self._part_size(batch_size - len(samples))
+            try:
+                samples.extend(self.generator.next_batch(part_size))
+            except StopIteration:
+                if len(samples) == 0:
+                    raise
+                break
+        self._count_generated(self.generator.generated_count - start)
+        return samples
+
+    def fill_array_batch(self, out: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+        """
+        Generate up to len(out) samples directly into out, see
+        GeneratorFromStrings.fill_array_batch
+        """
+        start = self.generator.generated_count
+        widths = []
+        labels = []
+        while len(labels) < len(out):
+            filled = len(labels)
+            part_size = self._part_size(len(out) - filled)
+            try:
+                part_widths, part_labels = self.generator.fill_array_batch(
+                    out[filled : filled + part_size]
+                )
+            except StopIteration:
+                if len(labels) == 0:
+                    raise
+                break
+            widths.append(part_widths)
+            labels.extend(part_labels)
+        self._count_generated(self.generator.generated_count - start)
+        return np.concatenate(widths), labels
+
+    def next_array_batch(
+        self, batch_size: int, max_width: int, charset: str = None
+    ) -> ArrayBatch:
+        """
+        Generate up to batch_size samples at once as arrays for a training loop,
+        see GeneratorFromStrings.next_array_batch
+        """
+        self.array_buffer = array_buffer(
+            self.array_buffer,
+            batch_size,
+            self.generator.size,
+            max_width,
+            self.generator.image_mode,
+        )
+        widths, labels = self.fill_array_batch(self.array_buffer)
+        return ArrayBatch(
+            self.array_buffer[: len(widths)], widths, *encode_labels(labels, charset)
+        )
@@ -1,14 +1,13 @@
 import os
 import pickle
+import threading
+import time
 import numpy as np
 import random as rnd
-import tensorflow as tf
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.mlab as mlab
-import seaborn
-from PIL import Image, ImageColor
+from PIL import Image, ImageColor, ImageDraw
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 import warnings
 
 warnings.filterwarnings("ignore")
@@ -38,199 +37,427 @@ def download_model_weights() -> str:
     return cwd
 
 
-def _sample(e, mu1, mu2, std1, std2, rho):
+def _sample(e, mu1, mu2, std1, std2, rho, random_state=np.random):
     cov = np.array([[std1 * std1, std1 * std2 * rho], [std1 * std2 * rho, std2 * std2]])
     mean = np.array([mu1, mu2])
 
-    x, y = np.random.multivariate_normal(mean, cov)
-    end = np.random.binomial(1, e)
+    x, y = random_state.multivariate_normal(mean, cov)
+    end = random_state.binomial(1, e)
     return np.array([x, y, end])
 
 
-def _split_strokes(points):
-    points = np.array(points)
-    strokes = []
-    b = 0
-    for e in range(len(points)):
-        if points[e, 2] == 1.0:
-            strokes += [points[b : e + 1, :2].copy()]
-            b = e + 1
-    return strokes
-
-
 def _cumsum(points):
     sums = np.cumsum(points[:, :2], axis=0)
     return np.concatenate([sums, points[:, 2:]], axis=1)
 
 
-def _sample_text(sess, args_text, translation):
+PARAM_FIELDS = [
+    "coordinates",
+    "sequence",
+    "bias",
+    "e",
+    "pi",
+    "mu1",
+    "mu2",
+    "std1",
+    "std2",
+    "rho",
+    "window",
+    "kappa",
+    "phi",
+    "finish",
+    "zero_states",
+]
+
+Params = namedtuple("Params", PARAM_FIELDS)
+
+ModelTimings = namedtuple("ModelTimings", ["load_time", "sample_time", "samples"])
+
+
+class HandwrittenModel(object):
+    """
+    Handwriting RNN restored in its own graph. The weights are loaded on first
+    use (or by warm_up) and kept until close is called.
+
+    The graph was exported with its RNN state in variables of batch size 1,
+    so a single session cannot advance several sequences at once. Batching is
+    done across sessions instead: the graph is restored in lanes sessions and
+    sample_batch advances up to lanes words in lockstep, one session each, see
+    _sample_texts. Every lane holds a copy of the weights, so the default of a
+    single lane samples one word at a time like the original generator.
+    """
+
+    def __init__(self, lanes: int = 1):
+        self.lanes = lanes
+        self.translation = None
+        self.graph = None
+        self.sessions = []
+        self.params = None
+        self.load_time = 0.0
+        self.sample_time = 0.0
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def loaded(self) -> bool:
+        return len(self.sessions) > 0
+
+    def load(self):
+        if self.loaded:
+            return
+        start = time.perf_counter()
+        cd = download_model_weights()
+        with open(
+            os.path.join(cd, os.path.join("handwritten_model", "translation.pkl")),
+            "rb",
+        ) as file:
+            self.translation = pickle.load(file)
+
+        # TensorFlow is only imported once a model is actually loaded
+        import tensorflow as tf
+
+        config = tf.compat.v1.ConfigProto(device_count={"GPU": 0})
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            saver = tf.compat.v1.train.import_meta_graph(
+                os.path.join(cd, "handwritten_model/model-29.meta")
+            )
+            # Variables, hence the RNN state, are held by the session
+            for _ in range(self.lanes):
+                session = tf.compat.v1.Session(graph=self.graph, config=config)
+                saver.restore(
+                    session,
+                    os.path.join(cd, os.path.join("handwritten_model/model-29")),
+                )
+                self.sessions.append(session)
+            self.params = Params(
+                *[self.graph.get_collection(name)[0] for name in PARAM_FIELDS]
+            )
+        self.graph.finalize()
+        self.load_time = time.perf_counter() - start
+
+    def warm_up(self):
+        """
+        Load the weights and run every session once so that it is ready to
+        sample, the time spent is counted as load time
+        """
+        self.load()
+        start = time.perf_counter()
+        for session in self.sessions:
+            _sample_text(
+                session, self.params, "a", self.translation, np.random.RandomState(0)
+            )
+        self.load_time += time.perf_counter() - start
+
+    def sample_batch(self, texts: List[str], rng=rnd) -> List:
+        """
+        Sample the strokes of several words, see _sample_text. Up to lanes
+        words are advanced together, each one stops on its own finish output
+        and the results come back in order.
+        """
+        self.load()
+        # Every word has its own random state, so the strokes do not depend on
+        # the other words of the batch
+        random_states = [np.random.RandomState(rng.getrandbits(32)) for _ in texts]
+        with self._lock:
+            start = time.perf_counter()
+            if self.lanes > 1 and self._executor is None:
+                # Sessions release the GIL while they run
+                self._executor = ThreadPoolExecutor(self.lanes)
+            run_map = map if self._executor is None else self._executor.map
+            results = []
+            for i in range(0, len(texts), len(self.sessions)):
+                results.extend(
+                    _sample_texts(
+                        self.sessions,
+                        self.params,
+                        texts[i : i + len(self.sessions)],
+                        self.translation,
+                        random_states[i : i + len(self.sessions)],
+                        run_map,
+                    )
+                )
+            self.sample_time += time.perf_counter() - start
+            self.samples += len(texts)
+        return results
+
+    def sample(self, text: str, rng=rnd):
+        return self.sample_batch([text], rng)[0]
+
+    def timings(self) -> ModelTimings:
+        return ModelTimings(self.load_time, self.sample_time, self.samples)
+
+    def close(self):
+        """Release the sessions, the model is loaded again on next use"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+            self.translation = None
+            self.graph = None
+            self.params = None
+            self.load_time = 0.0
+            self.sample_time = 0.0
+            self.samples = 0
+
+
+# Model of the current process, see get_model
+_model = None
+_model_lanes = 1
+
+
+def get_model() -> HandwrittenModel:
+    """Return the model of the current process, created on first use"""
+    global _model
+    if _model is None:
+        _model = HandwrittenModel(_model_lanes)
+    return _model
+
+
+def set_model_lanes(lanes: int):
+    """
+    Set how many words the model of the current process samples in parallel,
+    a model that is already loaded with another value is closed
+    """
+    global _model, _model_lanes
+    _model_lanes = lanes
+    if _model is not None and _model.lanes != lanes:
+        _model.close()
+        _model = None
+
+
+def warm_up():
+    """Load the model of the current process ahead of the first generate call"""
+    get_model().warm_up()
+
+
+def model_timings() -> ModelTimings:
+    return get_model().timings()
+
+
+def _sample_text(sess, vs, args_text, translation, random_state=np.random):
+    return _sample_texts([sess], vs, [args_text], translation, [random_state])[0]
+
+
+def _sample_texts(sessions, vs, texts, translation, random_states, run_map=map):
+    """
+    Sample the strokes of texts in lockstep, texts[i] on sessions[i] with
+    random_states[i]. Every step runs the sequences that are still active, a
+    sequence stops on its own finish output or after 60 steps per character.
+    run_map maps a step over the active sequences, an executor's map runs them
+    in parallel. Return (phi, window, kappa, strokes, coords) in text order.
+    """
+
     # Original creator said it helps (https://github.com/Grzego/handwriting-generation/issues/3)
-    args_text += " "
-
-    fields = [
-        "coordinates",
-        "sequence",
-        "bias",
-        "e",
-        "pi",
-        "mu1",
-        "mu2",
-        "std1",
-        "std2",
-        "rho",
-        "window",
-        "kappa",
-        "phi",
-        "finish",
-        "zero_states",
-    ]
-    vs = namedtuple("Params", fields)(
-        *[tf.compat.v1.get_collection(name)[0] for name in fields]
-    )
+    texts = [text + " " for text in texts]
+    sequences = []
+    for text in texts:
+        encoded = np.array([translation.get(c, 0) for c in text])
+        sequence = np.eye(len(translation), dtype=np.float32)[encoded]
+        sequences.append(
+            np.expand_dims(
+                np.concatenate([sequence, np.zeros((1, len(translation)))]), axis=0
+            )
+        )
 
-    text = np.array([translation.get(c, 0) for c in args_text])
-    sequence = np.eye(len(translation), dtype=np.float32)[text]
-    sequence = np.expand_dims(
-        np.concatenate([sequence, np.zeros((1, len(translation)))]), axis=0
-    )
+    coords = [[np.array([0.0, 0.0, 1.0])] for _ in texts]
+    phi_data = [[] for _ in texts]
+    window_data = [[] for _ in texts]
+    kappa_data = [[] for _ in texts]
+    stroke_data = [[] for _ in texts]
+    max_steps = np.array([60 * len(text) for text in texts])
+    # Stop mask of the sequences
+    active = np.ones(len(texts), dtype=bool)
+    fetches = [
+        vs.e,
+        vs.pi,
+        vs.mu1,
+        vs.mu2,
+        vs.std1,
+        vs.std2,
+        vs.rho,
+        vs.finish,
+        vs.phi,
+        vs.window,
+        vs.kappa,
+    ]
 
-    coord = np.array([0.0, 0.0, 1.0])
-    coords = [coord]
-
-    phi_data, window_data, kappa_data, stroke_data = [], [], [], []
-    sess.run(vs.zero_states)
-    for s in range(1, 60 * len(args_text) + 1):
-        e, pi, mu1, mu2, std1, std2, rho, finish, phi, window, kappa = sess.run(
-            [
-                vs.e,
-                vs.pi,
-                vs.mu1,
-                vs.mu2,
-                vs.std1,
-                vs.std2,
-                vs.rho,
-                vs.finish,
-                vs.phi,
-                vs.window,
-                vs.kappa,
-            ],
+    def run_step(i):
+        return sessions[i].run(
+            fetches,
             feed_dict={
-                vs.coordinates: coord[None, None, ...],
-                vs.sequence: sequence,
+                vs.coordinates: coords[i][-1][None, None, ...],
+                vs.sequence: sequences[i],
                 vs.bias: 1.0,
             },
         )
-        phi_data += [phi[0, :]]
-        window_data += [window[0, :]]
-        kappa_data += [kappa[0, :]]
-        # ---
-        g = np.random.choice(np.arange(pi.shape[1]), p=pi[0])
-        coord = _sample(
-            e[0, 0], mu1[0, g], mu2[0, g], std1[0, g], std2[0, g], rho[0, g]
-        )
-        coords += [coord]
-        stroke_data += [
-            [mu1[0, g], mu2[0, g], std1[0, g], std2[0, g], rho[0, g], coord[2]]
-        ]
-
-        if finish[0, 0] > 0.8:
-            break
 
-    coords = np.array(coords)
-    coords[-1, 2] = 1.0
-
-    return phi_data, window_data, kappa_data, stroke_data, coords
-
-
-def _crop_white_borders(image):
-    image_data = np.asarray(image)
-    grey_image_data = np.asarray(image.convert("L"))
-    non_empty_columns = np.where(grey_image_data.min(axis=0) < 255)[0]
-    non_empty_rows = np.where(grey_image_data.min(axis=1) < 255)[0]
-    cropBox = (
-        min(non_empty_rows),
-        max(non_empty_rows),
-        min(non_empty_columns),
-        max(non_empty_columns),
-    )
-    image_data_new = image_data[
-        cropBox[0] : cropBox[1] + 1, cropBox[2] : cropBox[3] + 1, :
-    ]
-
-    return Image.fromarray(image_data_new)
+    for i in range(len(texts)):
+        sessions[i].run(vs.zero_states)
+    step = 0
+    while active.any():
+        step += 1
+        indices = np.flatnonzero(active)
+        for i, outputs in zip(indices, list(run_map(run_step, indices))):
+            e, pi, mu1, mu2, std1, std2, rho, finish, phi, window, kappa = outputs
+            phi_data[i].append(phi[0, :])
+            window_data[i].append(window[0, :])
+            kappa_data[i].append(kappa[0, :])
+            # ---
+            random_state = random_states[i]
+            g = random_state.choice(np.arange(pi.shape[1]), p=pi[0])
+            coord = _sample(
+                e[0, 0],
+                mu1[0, g],
+                mu2[0, g],
+                std1[0, g],
+                std2[0, g],
+                rho[0, g],
+                random_state,
+            )
+            coords[i].append(coord)
+            stroke_data[i].append(
+                [mu1[0, g], mu2[0, g], std1[0, g], std2[0, g], rho[0, g], coord[2]]
+            )
+            if finish[0, 0] > 0.8 or step >= max_steps[i]:
+                active[i] = False
+
+    results = []
+    for i in range(len(texts)):
+        text_coords = np.array(coords[i])
+        text_coords[-1, 2] = 1.0
+        results.append(
+            (phi_data[i], window_data[i], kappa_data[i], stroke_data[i], text_coords)
+        )
+    return results
 
 
-def _join_images(images):
-    widths, heights = zip(*(i.size for i in images))
+# Size of the rasterized strokes in pixels: median distance between two pen
+# positions, width of the pen and space between words
+STEP_LENGTH = 3.0
+STROKE_WIDTH = 3
+WORD_SPACING = 24
 
-    total_width = sum(widths) - 35 * len(images)
-    max_height = max(heights)
+# The ink is drawn this many times larger and downsampled to anti-alias it
+SUPERSAMPLING = 4
 
-    compound_image = Image.new("RGBA", (total_width, max_height))
 
-    x_offset = 0
-    for im in images:
-        compound_image.paste(im, (x_offset, 0))
-        x_offset += im.size[0] - 35
+def _word_points(coords, phi_data, word_length: int):
+    """
+    Absolute pen positions of a sampled word, whether the pen is lifted after
+    each of them, and the index of the character the model was writing when
+    it reached them
+    """
 
-    return compound_image
+    points = _cumsum(np.array(coords))
+    # Point k is sampled at step k - 1, the first one is the pen start
+    attended = np.argmax(np.array(phi_data), axis=1)
+    chars = np.minimum(np.concatenate([[0], attended]), max(word_length - 1, 0))
+    return points[:, :2], points[:, 2] == 1.0, chars
 
 
-def generate(text, text_color):
-    cd = download_model_weights()
-    with open(
-        os.path.join(cd, os.path.join("handwritten_model", "translation.pkl")), "rb"
-    ) as file:
-        translation = pickle.load(file)
+def _pen_runs(pen_up, chars):
+    """
+    Group the segments drawn between consecutive points of a word into
+    polylines (start, end, char) that do not lift the pen and belong to a
+    single character
+    """
 
-    config = tf.compat.v1.ConfigProto(device_count={"GPU": 0})
-    tf.compat.v1.reset_default_graph()
-    with tf.compat.v1.Session(config=config) as sess:
-        saver = tf.compat.v1.train.import_meta_graph(
-            os.path.join(cd, "handwritten_model/model-29.meta")
-        )
-        saver.restore(
-            sess, os.path.join(cd, os.path.join("handwritten_model/model-29"))
-        )
-        images = []
-        colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
-        c1, c2 = colors[0], colors[-1]
-
-        color = "#{:02x}{:02x}{:02x}".format(
-            rnd.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
-            rnd.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
-            rnd.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
-        )
+    runs = []
+    for k in range(1, len(chars)):
+        if pen_up[k - 1]:
+            continue
+        if runs and runs[-1][1] == k - 1 and runs[-1][2] == chars[k]:
+            runs[-1][1] = k
+        else:
+            runs.append([k - 1, k, chars[k]])
+    return runs
+
+
+def _rasterize(words, text_color):
+    """
+    Draw the strokes of sampled words side by side on a shared baseline.
+    words holds (points, pen_up, chars, first_char_index) tuples, the mask
+    encodes the index of each character in the text like computer text does.
+    """
+
+    steps = np.concatenate(
+        [
+            np.hypot(*np.diff(points, axis=0).T)[~pen_up[:-1]]
+            for points, pen_up, _, _ in words
+        ]
+    )
+    steps = steps[steps > 0]
+    scale = STEP_LENGTH / (np.median(steps) if len(steps) else 1.0)
+
+    placed = []
+    x_offset = 0.0
+    for points, pen_up, chars, first_char in words:
+        points = points * scale
+        points[:, 0] += x_offset - points[:, 0].min()
+        x_offset = points[:, 0].max() + WORD_SPACING
+        placed.append((points, pen_up, chars + first_char))
+
+    all_points = np.concatenate([points for points, _, _ in placed])
+    origin = all_points.min(axis=0) - STROKE_WIDTH
+    width, height = (
+        int(v) for v in np.ceil(all_points.max(axis=0) - origin + STROKE_WIDTH)
+    )
 
-        for word in text.split(" "):
-            _, window_data, kappa_data, stroke_data, coords = _sample_text(
-                sess, word, translation
+    ink = Image.new("L", (width * SUPERSAMPLING, height * SUPERSAMPLING), 0)
+    mask = Image.new("RGB", (width, height), (0, 0, 0))
+    ink_draw = ImageDraw.Draw(ink)
+    mask_draw = ImageDraw.Draw(mask)
+    for points, pen_up, chars in placed:
+        points = points - origin
+        for start, end, char_index in _pen_runs(pen_up, chars):
+            run = [tuple(p) for p in points[start : end + 1]]
+            ink_draw.line(
+                [(x * SUPERSAMPLING, y * SUPERSAMPLING) for x, y in run],
+                fill=255,
+                width=STROKE_WIDTH * SUPERSAMPLING,
+                joint="curve",
+            )
+            mask_draw.line(
+                run,
+                fill=(
+                    int(char_index + 1) // (255 * 255),
+                    int(char_index + 1) // 255,
+                    int(char_index + 1) % 255,
+                ),
+                width=STROKE_WIDTH,
+                joint="curve",
             )
 
-            strokes = np.array(stroke_data)
-            strokes[:, :2] = np.cumsum(strokes[:, :2], axis=0)
-            _, maxx = np.min(strokes[:, 0]), np.max(strokes[:, 0])
-            miny, maxy = np.min(strokes[:, 1]), np.max(strokes[:, 1])
-
-            fig, ax = plt.subplots(1, 1)
-            fig.patch.set_visible(False)
-            ax.axis("off")
-
-            for stroke in _split_strokes(_cumsum(np.array(coords))):
-                plt.plot(stroke[:, 0], -stroke[:, 1], color=color)
-
-            fig.patch.set_alpha(0)
-            fig.patch.set_facecolor("none")
+    image = Image.new("RGBA", (width, height), text_color)
+    image.putalpha(ink.resize((width, height), Image.Resampling.BOX))
+    return image, mask
 
-            canvas = plt.get_current_fig_manager().canvas
-            canvas.draw()
 
-            s, (width, height) = canvas.print_to_buffer()
-            image = Image.frombytes("RGBA", (width, height), s)
-            mask = Image.new("RGB", (width, height), (0, 0, 0))
+def generate(text, text_color, rng=rnd):
+    model = get_model()
+    colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
+    c1, c2 = colors[0], colors[-1]
 
-            images.append(_crop_white_borders(image))
+    color = (
+        rng.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
+        rng.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
+        rng.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
+    )
 
-            plt.close()
+    words = text.split(" ")
+    sampled_words = []
+    first_char = 0
+    for word, sample in zip(words, model.sample_batch(words, rng)):
+        phi_data, _, _, _, coords = sample
+        sampled_words.append(
+            (*_word_points(coords, phi_data, len(word)), first_char)
+        )
+        # Skip the space, it has no strokes
+        first_char += len(word) + 1
 
-        return _join_images(images), mask
+    return _rasterize(sampled_words, color)
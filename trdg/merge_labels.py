@@ -0,0 +1,108 @@
+"""
+Merge the labels files written by the shards of a run into one labels.txt
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+from typing import List, Tuple
+
+SHARD_LABELS_PATTERN = re.compile(r"^labels\.(\d+)-(\d+)\.txt$")
+
+
+def shard_labels_name(start: int, end: int) -> str:
+    """Name of the labels file of the images from start to end (excluded)"""
+    return "labels.{:09d}-{:09d}.txt".format(start, end)
+
+
+def find_shard_labels(labels_dir: str) -> List[Tuple[int, int, str]]:
+    """List the (start, end, path) of the shard labels files of a directory"""
+    shards = []
+    for name in os.listdir(labels_dir):
+        match = SHARD_LABELS_PATTERN.match(name)
+        if match is not None:
+            start, end = int(match.group(1)), int(match.group(2))
+            shards.append((start, end, os.path.join(labels_dir, name)))
+    return sorted(shards)
+
+
+def merge_labels(labels_dir: str, output_path: str = None, count: int = None) -> int:
+    """
+    Concatenate the shard labels files of a directory in index order. The
+    shards must cover a contiguous range, starting at 0 and ending at count
+    when it is given. Return the number of lines written.
+    """
+
+    shards = find_shard_labels(labels_dir)
+    if len(shards) == 0:
+        raise ValueError("No shard labels files in {}".format(labels_dir))
+
+    expected_start = 0
+    for start, end, path in shards:
+        if start != expected_start:
+            raise ValueError(
+                "The shards do not cover the indices {} to {}".format(
+                    min(start, expected_start), max(start, expected_start)
+                )
+            )
+        expected_start = end
+    if count is not None and expected_start != count:
+        raise ValueError(
+            "The shards do not cover the indices {} to {}".format(
+                expected_start, count
+            )
+        )
+
+    if output_path is None:
+        output_path = os.path.join(labels_dir, "labels.txt")
+
+    lines = 0
+    with tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf8",
+        dir=os.path.dirname(os.path.abspath(output_path)),
+        delete=False,
+    ) as output:
+        for _, _, path in shards:
+            with open(path, "r", encoding="utf8") as f:
+                for line in f:
+                    output.write(line)
+                    lines += 1
+    os.replace(output.name, output_path)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge the labels files of the shards of a run into labels.txt"
+    )
+    parser.add_argument(
+        "labels_dir", type=str, help="Output directory the shards wrote to"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Path of the merged file, labels.txt in labels_dir by default",
+        default=None,
+    )
+    parser.add_argument(
+        "-c",
+        "--count",
+        type=int,
+        help="Number of images of the run, checks that no shard is missing",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    try:
+        lines = merge_labels(args.labels_dir, args.output, args.count)
+    except ValueError as e:
+        sys.exit(str(e))
+    print("Merged {} labels".format(lines))
+
+
+if __name__ == "__main__":
+    main()
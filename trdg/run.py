@@ -1,5 +1,6 @@
 import argparse
 import errno
+import itertools
 import os
 import sys
 
@@ -8,18 +9,35 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import random as rnd
 import string
 import sys
-from multiprocessing import Pool
+import threading
+from multiprocessing import Event, Pool
+from multiprocessing.util import Finalize
 
 from tqdm import tqdm
 
+from trdg import background_generator
 from trdg.data_generator import FakeTextDataGenerator
+from trdg.merge_labels import shard_labels_name
+from trdg.writers import (
+    AsyncWriter,
+    DirectoryWriter,
+    LmdbWriterProcess,
+    TarShardWriter,
+)
 from trdg.string_generator import (
-    create_strings_from_dict,
-    create_strings_from_file,
     create_strings_from_wikipedia,
-    create_strings_randomly,
+    iter_strings_from_dict,
+    iter_strings_from_file,
+    iter_strings_randomly,
+)
+from trdg.utils import (
+    font_cache_info,
+    iterate_bounded,
+    load_dict_index,
+    load_fonts,
+    sample_rng,
+    set_font_cache_size,
 )
-from trdg.utils import load_dict, load_fonts
 
 
 def margins(margin):
@@ -123,6 +141,75 @@ def parse_arguments():
         help="Define the number of thread to use for image generation",
         default=1,
     )
+    parser.add_argument(
+        "--start_index",
+        type=int,
+        nargs="?",
+        help="Only generate the images from this index on, with --seed they are the same as in a run starting at 0",
+        default=0,
+    )
+    parser.add_argument(
+        "--end_index",
+        type=int,
+        nargs="?",
+        help="Only generate the images before this index, defaults to the count",
+        default=None,
+    )
+    parser.add_argument(
+        "--shard_index",
+        type=int,
+        nargs="?",
+        help="Only generate the shard_index-th of shard_count equal parts of the index range, use with --seed to spread a dataset over several machines",
+        default=0,
+    )
+    parser.add_argument(
+        "--shard_count",
+        type=int,
+        nargs="?",
+        help="Number of shards the index range is split into",
+        default=1,
+    )
+    parser.add_argument(
+        "-of",
+        "--output_format",
+        type=str,
+        nargs="?",
+        choices=["files", "tar", "lmdb"],
+        help="files: one file per image (and mask/boxes), tar: tar shards with the image, mask and a JSON of the label and boxes of every sample, written by each process, lmdb: an LMDB database in output_dir with image-[ID] and label-[ID] keys (ID starting at 1), written by a single process",
+        default="files",
+    )
+    parser.add_argument(
+        "-tss",
+        "--tar_shard_size",
+        type=int,
+        nargs="?",
+        help="Size in MB after which a tar shard is closed and a new one started",
+        default=256,
+    )
+    parser.add_argument(
+        "-wt",
+        "--write_threads",
+        type=int,
+        nargs="?",
+        help="Number of threads of each process that encode and save the samples while the next ones are rendered, 0 to save them before rendering the next one",
+        default=0,
+    )
+    parser.add_argument(
+        "-lbs",
+        "--lmdb_batch_size",
+        type=int,
+        nargs="?",
+        help="Number of samples written to the LMDB database per transaction",
+        default=1000,
+    )
+    parser.add_argument(
+        "-sd",
+        "--seed",
+        type=int,
+        nargs="?",
+        help="Seed of the run: every image only depends on it and on the image index, whatever the number of threads",
+        default=None,
+    )
     parser.add_argument(
         "-e",
         "--extension",
@@ -182,6 +269,14 @@ def parse_arguments():
         action="store_true",
         help='Define if the data will be "handwritten" by an RNN',
     )
+    parser.add_argument(
+        "-hwl",
+        "--handwritten_lanes",
+        type=int,
+        nargs="?",
+        help="Number of words the handwriting RNN of each process samples in parallel",
+        default=1,
+    )
     parser.add_argument(
         "-na",
         "--name_format",
@@ -300,6 +395,44 @@ def parse_arguments():
         help="Define an image directory to use when background is set to image",
         default=os.path.join(os.path.split(os.path.realpath(__file__))[0], "images"),
     )
+    parser.add_argument(
+        "-ics",
+        "--image_cache_size",
+        type=int,
+        nargs="?",
+        help="Memory in MB each process may use to keep decoded background images",
+        default=256,
+    )
+    parser.add_argument(
+        "-imh",
+        "--image_max_height",
+        type=int,
+        nargs="?",
+        help="Downscale background images taller than this once they are decoded, 0 to keep them as is",
+        default=0,
+    )
+    parser.add_argument(
+        "-ipf",
+        "--image_prefetch",
+        action="store_true",
+        help="Decode the background images of each process before generating",
+        default=False,
+    )
+    parser.add_argument(
+        "-nat",
+        "--noise_atlas",
+        action="store_true",
+        help="Crop gaussian noise backgrounds from a noise texture drawn once per process instead of drawing new noise for each image",
+        default=False,
+    )
+    parser.add_argument(
+        "-natr",
+        "--noise_atlas_refresh",
+        type=int,
+        nargs="?",
+        help="Draw the noise texture again every N images, 0 to keep it. With --seed, the texture of an image only depends on its index",
+        default=0,
+    )
     parser.add_argument(
         "-ca",
         "--case",
@@ -341,9 +474,135 @@ def parse_arguments():
         help="Define the image mode to be used. RGB is default, L means 8-bit grayscale images, 1 means 1-bit binary images stored with one pixel per byte, etc.",
         default="RGB",
     )
+    parser.add_argument(
+        "-fcs",
+        "--font_cache_size",
+        type=int,
+        nargs="?",
+        help="Define how many loaded fonts (one per font and size) each process keeps in memory",
+        default=128,
+    )
+    parser.add_argument(
+        "--font_cache_stats",
+        action="store_true",
+        help="Print the hits and misses of the font cache once the generation is done",
+        default=False,
+    )
     return parser.parse_args()
 
 
+# Arguments of FakeTextDataGenerator.generate shared by all the images,
+# sent once to every worker, and seed of the run
+_worker_config = None
+_worker_seed = None
+
+
+def init_worker(
+    config,
+    font_cache_size,
+    handwritten_lanes,
+    image_pool_settings,
+    noise_atlas,
+    seed,
+    tar_shard_size,
+    lmdb_writer,
+    write_threads,
+    write_failed,
+):
+    global _worker_config, _worker_seed
+    _worker_config = config
+    _worker_seed = seed
+    writer = None
+    if tar_shard_size is not None:
+        writer = TarShardWriter(config["out_dir"], tar_shard_size)
+    if lmdb_writer is not None:
+        writer = lmdb_writer
+    if write_threads > 0:
+        if writer is None:
+            writer = DirectoryWriter(config["out_dir"])
+        writer = AsyncWriter(writer, write_threads)
+    if writer is not None:
+        # The pending samples and the last shard are written when the worker
+        # exits, too late to fail an item
+        Finalize(writer, close_writer, args=(writer, write_failed), exitpriority=10)
+        _worker_config = dict(config, writer=writer)
+    set_font_cache_size(font_cache_size)
+    background_generator.configure_image_pools(**image_pool_settings)
+    if noise_atlas is not None:
+        background_generator.configure_noise_atlas(
+            refresh_every=noise_atlas, seed=seed
+        )
+    if image_pool_settings["prefetch"] and config["background_type"] == 3:
+        background_generator.get_image_pool(config["image_dir"])
+    if config["is_handwritten"]:
+        from trdg import handwritten_text_generator
+
+        handwritten_text_generator.set_model_lanes(handwritten_lanes)
+        # Every worker keeps its own model, loaded before the first item
+        handwritten_text_generator.warm_up()
+
+
+def close_writer(writer, write_failed):
+    """Close the writer of a worker, and tell the parent if it fails"""
+    try:
+        writer.close()
+    except BaseException:
+        write_failed.set()
+        raise
+
+
+def generate_from_item(item):
+    """
+    Generate the image of an (index, text, font) item in a worker and report
+    the state of its font cache and handwritten model
+    """
+
+    index, text, font = item
+    rng = rnd if _worker_seed is None else sample_rng(_worker_seed, index)
+    FakeTextDataGenerator.generate(index, text, font, rng=rng, **_worker_config)
+    model_timings = None
+    if _worker_config["is_handwritten"]:
+        from trdg import handwritten_text_generator
+
+        model_timings = handwritten_text_generator.model_timings()
+    return os.getpid(), font_cache_info(), model_timings
+
+
+def index_range(
+    count: int, start_index: int, end_index: int, shard_index: int, shard_count: int
+):
+    """
+    Return the (start, end) indices a job generates: the shard_index-th of
+    shard_count contiguous parts of [start_index, end_index)
+    """
+
+    end_index = count if end_index is None else end_index
+    if not 0 <= start_index <= end_index <= count:
+        raise ValueError("The index range must be within 0 and the count")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("The shard index must be within 0 and the shard count")
+
+    length = end_index - start_index
+    return (
+        start_index + length * shard_index // shard_count,
+        start_index + length * (shard_index + 1) // shard_count,
+    )
+
+
+def write_labels(items, labels_file, extension: str, space_width: float):
+    """
+    Write the filename-to-label line of every (index, text, font) item as it
+    goes through
+    """
+
+    for item in items:
+        index, text, _ = item
+        if space_width == 0:
+            text = text.replace(" ", "")
+        labels_file.write("{}.{} {}\n".format(index, extension, text))
+        yield item
+
+
 def main():
     """
     Description: Main function
@@ -359,18 +618,30 @@ def main():
         if e.errno != errno.EEXIST:
             raise
 
-    # Creating word list
-    if args.dict:
-        lang_dict = []
-        if os.path.isfile(args.dict):
-            with open(args.dict, "r", encoding="utf8", errors="ignore") as d:
-                lang_dict = [l for l in d.read().splitlines() if len(l) > 0]
-        else:
-            sys.exit("Cannot open dict")
-    else:
-        lang_dict = load_dict(
-            os.path.join(os.path.dirname(__file__), "dicts", args.language + ".txt")
+    if args.dict and not os.path.isfile(args.dict):
+        sys.exit("Cannot open dict")
+
+    # Wikipedia sentences are drawn in this process, so the seed fixes them
+    # as well
+    if args.seed is not None:
+        rnd.seed(args.seed)
+
+    try:
+        start, end = index_range(
+            args.count,
+            args.start_index,
+            args.end_index,
+            args.shard_index,
+            args.shard_count,
         )
+    except ValueError as e:
+        sys.exit(str(e))
+
+    # With a seed, the text and the font of every sample are drawn from
+    # generators of its own, so a job starts right at its range
+    text_rngs = None
+    if args.seed is not None:
+        text_rngs = (sample_rng(args.seed, i, 1) for i in range(start, end))
 
     # Create font (path) list
     if args.font_dir:
@@ -387,15 +658,16 @@ def main():
     else:
         fonts = load_fonts(args.language)
 
-    # Creating synthetic sentences (or word)
-    strings = []
-
+    # Creating synthetic sentences (or word), lazily so that rendering starts
+    # right away and memory does not grow with the count
     if args.use_wikipedia:
-        strings = create_strings_from_wikipedia(args.length, args.count, args.language)
+        strings = iter(
+            create_strings_from_wikipedia(args.length, args.count, args.language)
+        )
     elif args.input_file != "":
-        strings = create_strings_from_file(args.input_file, args.count)
+        strings = iter_strings_from_file(args.input_file, args.count)
     elif args.random_sequences:
-        strings = create_strings_randomly(
+        strings = iter_strings_randomly(
             args.length,
             args.random,
             args.count,
@@ -403,6 +675,7 @@ def main():
             args.include_numbers,
             args.include_symbols,
             args.language,
+            text_rngs,
         )
         # Set a name format compatible with special characters automatically if they are used
         if args.include_symbols or True not in (
@@ -412,81 +685,176 @@ def main():
         ):
             args.name_format = 2
     else:
-        strings = create_strings_from_dict(
-            args.length, args.random, args.count, lang_dict
+        # Creating word list
+        if args.dict:
+            lang_dict = load_dict_index(args.dict)
+        else:
+            lang_dict = load_dict_index(
+                os.path.join(
+                    os.path.dirname(__file__), "dicts", args.language + ".txt"
+                )
+            )
+        strings = iter_strings_from_dict(
+            args.length, args.random, args.count, lang_dict, text_rngs
         )
+    if text_rngs is None or args.use_wikipedia or args.input_file != "":
+        # The strings before the range are skipped
+        strings = itertools.islice(strings, start, end)
 
     if args.language == "ar":
         from arabic_reshaper import ArabicReshaper
         from bidi.algorithm import get_display
 
         arabic_reshaper = ArabicReshaper()
-        strings = [
+        strings = (
             " ".join(
                 [get_display(arabic_reshaper.reshape(w)) for w in s.split(" ")[::-1]]
             )
             for s in strings
-        ]
+        )
     if args.case == "upper":
-        strings = [x.upper() for x in strings]
+        strings = (x.upper() for x in strings)
     if args.case == "lower":
-        strings = [x.lower() for x in strings]
-
-    string_count = len(strings)
-
-    p = Pool(args.thread_count)
-    for _ in tqdm(
-        p.imap_unordered(
-            FakeTextDataGenerator.generate_from_tuple,
-            zip(
-                [i for i in range(0, string_count)],
-                strings,
-                [fonts[rnd.randrange(0, len(fonts))] for _ in range(0, string_count)],
-                [args.output_dir] * string_count,
-                [args.format] * string_count,
-                [args.extension] * string_count,
-                [args.skew_angle] * string_count,
-                [args.random_skew] * string_count,
-                [args.blur] * string_count,
-                [args.random_blur] * string_count,
-                [args.background] * string_count,
-                [args.distorsion] * string_count,
-                [args.distorsion_orientation] * string_count,
-                [args.handwritten] * string_count,
-                [args.name_format] * string_count,
-                [args.width] * string_count,
-                [args.alignment] * string_count,
-                [args.text_color] * string_count,
-                [args.orientation] * string_count,
-                [args.space_width] * string_count,
-                [args.character_spacing] * string_count,
-                [args.margins] * string_count,
-                [args.fit] * string_count,
-                [args.output_mask] * string_count,
-                [args.word_split] * string_count,
-                [args.image_dir] * string_count,
-                [args.stroke_width] * string_count,
-                [args.stroke_fill] * string_count,
-                [args.image_mode] * string_count,
-                [args.output_bboxes] * string_count,
-            ),
+        strings = (x.lower() for x in strings)
+
+    config = {
+        "out_dir": args.output_dir,
+        "size": args.format,
+        "extension": args.extension,
+        "skewing_angle": args.skew_angle,
+        "random_skew": args.random_skew,
+        "blur": args.blur,
+        "random_blur": args.random_blur,
+        "background_type": args.background,
+        "distorsion_type": args.distorsion,
+        "distorsion_orientation": args.distorsion_orientation,
+        "is_handwritten": args.handwritten,
+        "name_format": args.name_format,
+        "width": args.width,
+        "alignment": args.alignment,
+        "text_color": args.text_color,
+        "orientation": args.orientation,
+        "space_width": args.space_width,
+        "character_spacing": args.character_spacing,
+        "margins": args.margins,
+        "fit": args.fit,
+        "output_mask": args.output_mask,
+        "word_split": args.word_split,
+        "image_dir": args.image_dir,
+        "stroke_width": args.stroke_width,
+        "stroke_fill": args.stroke_fill,
+        "image_mode": args.image_mode,
+        "output_bboxes": args.output_bboxes,
+    }
+    # Send a few items per message, in chunks small enough to keep every
+    # worker busy until the end
+    chunksize = max(1, min(64, (end - start) // (args.thread_count * 16)))
+    # Only a bounded number of items is in flight so the parent memory does not
+    # grow with the count
+    pending_items = threading.Semaphore(chunksize * args.thread_count * 4)
+    stop_items = threading.Event()
+    if args.seed is None:
+        item_fonts = (fonts[rnd.randrange(0, len(fonts))] for _ in range(start, end))
+    else:
+        item_fonts = (
+            fonts[sample_rng(args.seed, i, 2).randrange(0, len(fonts))]
+            for i in range(start, end)
+        )
+    items = zip(range(start, end), strings, item_fonts)
+
+    labels_file = None
+    # Tar shards and LMDB databases hold the labels of their samples
+    if args.name_format == 2 and args.output_format == "files":
+        # Create file with filename-to-label connections, one per range when
+        # the job does not generate all the images
+        labels_name = "labels.txt"
+        if (start, end) != (0, args.count):
+            labels_name = shard_labels_name(start, end)
+        labels_file = open(
+            os.path.join(args.output_dir, labels_name), "w", encoding="utf8"
+        )
+        items = write_labels(items, labels_file, args.extension, args.space_width)
+
+    lmdb_process = None
+    if args.output_format == "lmdb":
+        # Workers encode the samples, a single process writes the database
+        lmdb_process = LmdbWriterProcess(
+            args.output_dir,
+            batch_size=args.lmdb_batch_size,
+            max_pending=args.lmdb_batch_size * 2,
+        )
+
+    font_cache_infos = {}
+    model_timings = {}
+    write_failed = Event()
+    p = Pool(
+        args.thread_count,
+        initializer=init_worker,
+        initargs=(
+            config,
+            args.font_cache_size,
+            args.handwritten_lanes,
+            {
+                "max_bytes": args.image_cache_size << 20,
+                "max_height": args.image_max_height,
+                "prefetch": args.image_prefetch,
+            },
+            args.noise_atlas_refresh if args.noise_atlas else None,
+            args.seed,
+            args.tar_shard_size << 20 if args.output_format == "tar" else None,
+            lmdb_process.queue_writer() if lmdb_process is not None else None,
+            args.write_threads,
+            write_failed,
         ),
-        total=args.count,
-    ):
-        pass
-    p.terminate()
-
-    if args.name_format == 2:
-        # Create file with filename-to-label connections
-        with open(
-            os.path.join(args.output_dir, "labels.txt"), "w", encoding="utf8"
-        ) as f:
-            for i in range(string_count):
-                file_name = str(i) + "." + args.extension
-                label = strings[i]
-                if args.space_width == 0:
-                    label = label.replace(" ", "")
-                f.write("{} {}\n".format(file_name, label))
+    )
+    try:
+        for pid, cache_info, timings in tqdm(
+            p.imap_unordered(
+                generate_from_item,
+                iterate_bounded(items, pending_items, stop_items),
+                chunksize=chunksize,
+            ),
+            total=end - start,
+        ):
+            font_cache_infos[pid] = cache_info
+            model_timings[pid] = timings
+            pending_items.release()
+    except BaseException:
+        # A worker failed or the run was interrupted: unblock the thread
+        # feeding the pool, which terminate waits for
+        stop_items.set()
+        pending_items.release()
+        p.terminate()
+        raise
+    # Let the workers exit on their own so that they complete their output
+    p.close()
+    p.join()
+    if labels_file is not None:
+        labels_file.close()
+    if lmdb_process is not None:
+        lmdb_process.close()
+    if write_failed.is_set():
+        sys.exit("A worker failed to write its last samples")
+
+    if args.font_cache_stats:
+        hits = sum(info.hits for info in font_cache_infos.values())
+        misses = sum(info.misses for info in font_cache_infos.values())
+        print(
+            "Font cache: {} hits, {} misses over {} processes".format(
+                hits, misses, len(font_cache_infos)
+            )
+        )
+
+    if args.handwritten:
+        print(
+            "Handwritten model: {:.1f}s loading, {:.1f}s sampling {} words "
+            "over {} processes".format(
+                sum(t.load_time for t in model_timings.values()),
+                sum(t.sample_time for t in model_timings.values()),
+                sum(t.samples for t in model_timings.values()),
+                len(model_timings),
+            )
+        )
 
 
 if __name__ == "__main__":
@@ -1,8 +1,6 @@
 import random as rnd
 import string
-from typing import List
-
-import wikipedia
+from typing import Iterator, List, Sequence
 
 
 def create_strings_from_file(filename: str, count: int) -> List[str]:
@@ -10,40 +8,71 @@ def create_strings_from_file(filename: str, count: int) -> List[str]:
     Create all strings by reading lines in specified files
     """
 
-    strings = []
+    return list(iter_strings_from_file(filename, max(count, 0)))
 
-    with open(filename, "r", encoding="utf8") as f:
-        lines = [l[0:200] for l in f.read().splitlines() if len(l) > 0]
-        if len(lines) == 0:
-            raise Exception("No lines could be read in file")
-        while len(strings) < count:
-            if len(lines) >= count - len(strings):
-                strings.extend(lines[0 : count - len(strings)])
-            else:
-                strings.extend(lines)
 
-    return strings
+def iter_strings_from_file(filename: str, count: int = -1) -> Iterator[str]:
+    """
+    Yield strings by reading the lines of the specified file one at a time,
+    starting over when the end of the file is reached. A count of -1 never stops.
+    """
+
+    generated_count = 0
+    while generated_count != count:
+        read_count = 0
+        with open(filename, "r", encoding="utf8") as f:
+            for line in f:
+                for l in line.splitlines():
+                    if len(l) == 0:
+                        continue
+                    read_count += 1
+                    yield l[0:200]
+                    generated_count += 1
+                    if generated_count == count:
+                        return
+        if read_count == 0:
+            raise Exception("No lines could be read in file")
 
 
 def create_strings_from_dict(
-    length: int, allow_variable: bool, count: int, lang_dict: List[str]
+    length: int, allow_variable: bool, count: int, lang_dict: Sequence[str]
 ) -> List[str]:
     """
     Create all strings by picking X random word in the dictionary
     """
 
+    return list(
+        iter_strings_from_dict(length, allow_variable, max(count, 0), lang_dict)
+    )
+
+
+def iter_strings_from_dict(
+    length: int,
+    allow_variable: bool,
+    count: int,
+    lang_dict: Sequence[str],
+    rngs: Iterator[rnd.Random] = None,
+) -> Iterator[str]:
+    """
+    Yield strings made of X random words of the dictionary. A count of -1 never
+    stops. Every string is drawn from the next of rngs if given.
+    """
+
     dict_len = len(lang_dict)
-    strings = []
-    for _ in range(0, count):
+    generated_count = 0
+    while generated_count != count:
+        rng = rnd if rngs is None else next(rngs)
         current_string = ""
-        for _ in range(0, rnd.randint(1, length) if allow_variable else length):
-            current_string += lang_dict[rnd.randrange(dict_len)]
+        for _ in range(0, rng.randint(1, length) if allow_variable else length):
+            current_string += lang_dict[rng.randrange(dict_len)]
             current_string += " "
-        strings.append(current_string[:-1])
-    return strings
+        yield current_string[:-1]
+        generated_count += 1
 
 
 def get_random_page_content() -> str:
+    import wikipedia
+
     page_title = wikipedia.random(1)
     try:
         page_content = wikipedia.page(page_title).summary
@@ -56,20 +85,14 @@ def create_strings_from_wikipedia(
     minimum_length: int, count: int, lang: str
 ) -> List[str]:
     """
-    Create all string by randomly picking Wikipedia articles and taking sentences from them.
+    Create all string by randomly picking sentences of Wikipedia articles. They
+    are drawn from an on-disk cache, filled with new articles when it does not
+    hold enough of them, see trdg.wikipedia_cache.
     """
-    wikipedia.set_lang(lang)
-    sentences = []
-
-    while len(sentences) < count:
-        page_content = get_random_page_content()
-        processed_content = page_content.replace("\n", " ").split(". ")
-        sentence_candidates = [
-            s.strip() for s in processed_content if len(s.split()) > minimum_length
-        ]
-        sentences.extend(sentence_candidates)
+    # Only imported when needed, with the asyncio and HTTP stack behind it
+    from trdg.wikipedia_cache import draw_sentences
 
-    return sentences[0:count]
+    return draw_sentences(lang, minimum_length, count)
 
 
 def create_strings_randomly(
@@ -85,6 +108,28 @@ def create_strings_randomly(
     Create all strings by randomly sampling from a pool of characters.
     """
 
+    return list(
+        iter_strings_randomly(
+            length, allow_variable, max(count, 0), let, num, sym, lang
+        )
+    )
+
+
+def iter_strings_randomly(
+    length: int,
+    allow_variable: bool,
+    count: int,
+    let: bool,
+    num: bool,
+    sym: bool,
+    lang: str,
+    rngs: Iterator[rnd.Random] = None,
+) -> Iterator[str]:
+    """
+    Yield strings randomly sampled from a pool of characters. A count of -1
+    never stops. Every string is drawn from the next of rngs if given.
+    """
+
     # If none specified, use all three
     if True not in (let, num, sym):
         let, num, sym = True, True, True
@@ -129,12 +174,13 @@ def create_strings_randomly(
         min_seq_len = 2
         max_seq_len = 10
 
-    strings = []
-    for _ in range(0, count):
+    generated_count = 0
+    while generated_count != count:
+        rng = rnd if rngs is None else next(rngs)
         current_string = ""
-        for _ in range(0, rnd.randint(1, length) if allow_variable else length):
-            seq_len = rnd.randint(min_seq_len, max_seq_len)
-            current_string += "".join([rnd.choice(pool) for _ in range(seq_len)])
+        for _ in range(0, rng.randint(1, length) if allow_variable else length):
+            seq_len = rng.randint(min_seq_len, max_seq_len)
+            current_string += "".join([rng.choice(pool) for _ in range(seq_len)])
             current_string += " "
-        strings.append(current_string[:-1])
-    return strings
+        yield current_string[:-1]
+        generated_count += 1
@@ -2,10 +2,17 @@
 Utility functions
 """
 
+import functools
+import hashlib
+import mmap
 import os
+import random
 import re
+import tempfile
 import unicodedata
-from typing import List, Tuple
+from collections import namedtuple
+from collections.abc import Sequence
+from typing import Iterable, Iterator, List, Tuple
 
 from fontTools.ttLib import TTFont
 
@@ -28,6 +35,86 @@ def load_dict(path: str) -> List[str]:
     return word_dict
 
 
+class DictIndex(Sequence):
+    """
+    Words of a dictionary file, stored as a UTF-8 blob and an array of offsets.
+    Both are built once per file in the cache directory and memory-mapped, so
+    that all processes share the same pages and no word is kept as a Python
+    object until it is picked.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets, self.words = _load_dict_index_files(path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("dictionary index out of range")
+        return self.words[int(self.offsets[i]) : int(self.offsets[i + 1])].decode(
+            "utf8"
+        )
+
+    def __reduce__(self):
+        # Other processes map the files again instead of receiving the words
+        return DictIndex, (self.path,)
+
+
+def _build_dict_index(path: str) -> Tuple[np.ndarray, bytes]:
+    encoded_words = [w.encode("utf8") for w in load_dict(path)]
+    words = b"".join(encoded_words)
+    offsets = np.zeros(
+        len(encoded_words) + 1,
+        dtype=np.uint32 if len(words) < 2**32 else np.uint64,
+    )
+    np.cumsum([len(w) for w in encoded_words], out=offsets[1:])
+    return offsets, words
+
+
+def _load_dict_index_files(path: str) -> Tuple[np.ndarray, bytes]:
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = "{}:{}:{}".format(path, stat.st_mtime_ns, stat.st_size)
+    cache_dir = os.path.join(get_cache_dir(), "dicts")
+    cache_name = os.path.join(
+        cache_dir, hashlib.sha1(key.encode("utf8")).hexdigest()
+    )
+    offsets_path, words_path = cache_name + ".offsets.npy", cache_name + ".words"
+
+    if not os.path.isfile(offsets_path):
+        offsets, words = _build_dict_index(path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+                f.write(words)
+            os.replace(f.name, words_path)
+            # The offsets are written last, their presence means the index is complete
+            with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+                np.save(f, offsets)
+            os.replace(f.name, offsets_path)
+        except OSError:
+            # The cache directory is not writable, keep the index in memory
+            return offsets, words
+
+    offsets = np.load(offsets_path, mmap_mode="r")
+    if offsets[-1] == 0:
+        # Empty files cannot be memory-mapped
+        return offsets, b""
+    with open(words_path, "rb") as f:
+        return offsets, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_dict_index(path: str) -> DictIndex:
+    """
+    Open the memory-mapped index of a dictionary file, see DictIndex
+    """
+    return DictIndex(path)
+
+
 def load_fonts(lang: str) -> List[str]:
     """Load all fonts in the fonts directories"""
 
@@ -47,58 +134,132 @@ def load_fonts(lang: str) -> List[str]:
         ]
 
 
+def _load_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font=font, size=size)
+
+
+_cached_load_font = functools.lru_cache(maxsize=128)(_load_font)
+
+FontCacheInfo = namedtuple("FontCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def load_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    Load a font at a given size, reusing the FreeTypeFont objects of this process
+    """
+    return _cached_load_font(font, size)
+
+
+def set_font_cache_size(size: int) -> None:
+    """
+    Set the number of (font, size) pairs kept by load_font. This empties the
+    cache and resets its counters.
+    """
+    global _cached_load_font
+    _cached_load_font = functools.lru_cache(maxsize=size)(_load_font)
+
+
+def font_cache_info():
+    """
+    Return the hits, misses, maxsize and currsize of the load_font cache
+    """
+    return FontCacheInfo(*_cached_load_font.cache_info())
+
+
+def mask_to_labels(mask: Image) -> np.ndarray:
+    """
+    Decode the RGB-encoded character ids of a mask into an integer label image.
+    Pixels that do not hold a valid character id are labeled 0.
+    """
+
+    mask_arr = np.asarray(mask)
+    if mask_arr.ndim != 3 or mask_arr.shape[-1] != 3:
+        return np.zeros(mask_arr.shape[:2], dtype=np.int32)
+
+    r = mask_arr[..., 0].astype(np.int32)
+    g = mask_arr[..., 1].astype(np.int32)
+    b = mask_arr[..., 2].astype(np.int32)
+
+    # Inverse of the (i // (255 * 255), i // 255, i % 255) encoding used by
+    # computer_text_generator, keeping only the colors it can produce
+    labels = np.where((r == 0) & (g < 255), g * 255 + b, 0)
+    labels = np.where((r == 1) & (g == 255), 255 * 255 + b, labels)
+    labels[b == 255] = 0
+
+    return labels
+
+
 def mask_to_bboxes(mask: List[Tuple[int, int, int, int]], tess: bool = False):
     """Process the mask and turns it into a list of AABB bounding boxes"""
 
-    mask_arr = np.array(mask)
+    labels = mask_to_labels(mask)
+    height, width = labels.shape
+
+    # Gather the extent of every character in a single pass over the mask
+    flat_labels = labels.ravel()
+    positions = np.flatnonzero(flat_labels)
+    order = np.argsort(flat_labels[positions], kind="stable")
+    positions = positions[order]
+    sorted_labels = flat_labels[positions]
+    rows, cols = np.divmod(positions, width)
+
+    starts = np.flatnonzero(np.diff(sorted_labels, prepend=-1))
+    extents = {}
+    if len(starts) > 0:
+        ends = np.append(starts[1:], len(sorted_labels)) - 1
+        # Positions are sorted in row-major order within each label
+        min_rows, max_rows = rows[starts], rows[ends]
+        min_cols = np.minimum.reduceat(cols, starts)
+        max_cols = np.maximum.reduceat(cols, starts)
+        extents = {
+            int(l): (int(x1), int(y1), int(x2), int(y2))
+            for l, x1, y1, x2, y2 in zip(
+                sorted_labels[starts], min_cols, min_rows, max_cols, max_rows
+            )
+        }
 
     bboxes = []
 
-    i = 0
+    # Characters are numbered from 1, a single missing id is a space and two
+    # consecutive missing ids mark the end of the text
+    i = 1
     space_thresh = 1
     while True:
-        try:
-            color_tuple = ((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255)
-            letter = np.where(np.all(mask_arr == color_tuple, axis=-1))
-            if space_thresh == 0 and letter:
-                x1 = min(bboxes[-1][2] + 1, np.min(letter[1]) - 1)
-                y1 = (
-                    min(bboxes[-1][3] + 1, np.min(letter[0]) - 1)
-                    if not tess
-                    else min(
-                        mask_arr.shape[0] - np.min(letter[0]) + 2, bboxes[-1][1] - 1
-                    )
-                )
-                x2 = max(bboxes[-1][2] + 1, np.min(letter[1]) - 2)
-                y2 = (
-                    max(bboxes[-1][3] + 1, np.min(letter[0]) - 2)
-                    if not tess
-                    else max(
-                        mask_arr.shape[0] - np.min(letter[0]) + 2, bboxes[-1][1] - 1
-                    )
-                )
-                bboxes.append((x1, y1, x2, y2))
-                space_thresh += 1
-            bboxes.append(
-                (
-                    max(0, np.min(letter[1]) - 1),
-                    max(0, np.min(letter[0]) - 1)
-                    if not tess
-                    else max(0, mask_arr.shape[0] - np.max(letter[0]) - 1),
-                    min(mask_arr.shape[1] - 1, np.max(letter[1]) + 1),
-                    min(mask_arr.shape[0] - 1, np.max(letter[0]) + 1)
-                    if not tess
-                    else min(
-                        mask_arr.shape[0] - 1, mask_arr.shape[0] - np.min(letter[0]) + 1
-                    ),
-                )
-            )
-            i += 1
-        except Exception as ex:
+        if i not in extents:
             if space_thresh == 0:
                 break
             space_thresh -= 1
             i += 1
+            continue
+        min_x, min_y, max_x, max_y = extents[i]
+        if space_thresh == 0:
+            if not bboxes:
+                break
+            x1 = min(bboxes[-1][2] + 1, min_x - 1)
+            y1 = (
+                min(bboxes[-1][3] + 1, min_y - 1)
+                if not tess
+                else min(height - min_y + 2, bboxes[-1][1] - 1)
+            )
+            x2 = max(bboxes[-1][2] + 1, min_x - 2)
+            y2 = (
+                max(bboxes[-1][3] + 1, min_y - 2)
+                if not tess
+                else max(height - min_y + 2, bboxes[-1][1] - 1)
+            )
+            bboxes.append((x1, y1, x2, y2))
+            space_thresh += 1
+        bboxes.append(
+            (
+                max(0, min_x - 1),
+                max(0, min_y - 1) if not tess else max(0, height - max_y - 1),
+                min(width - 1, max_x + 1),
+                min(height - 1, max_y + 1)
+                if not tess
+                else min(height - 1, height - min_y + 1),
+            )
+        )
+        i += 1
 
     return bboxes
 
@@ -151,26 +312,179 @@ def get_text_height(image_font: ImageFont, text: str) -> int:
     return bottom
 
 
+def get_cache_dir() -> str:
+    """
+    Return the directory of the on-disk caches, TRDG_CACHE_DIR or ~/.cache/trdg
+    """
+    return os.environ.get(
+        "TRDG_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "trdg")
+    )
+
+
+# Code points covered by each font path, loaded once per process
+_glyph_coverages = {}
+
+
+def _read_glyph_coverage(font_path: str) -> np.ndarray:
+    font = TTFont(font_path, lazy=True)
+    try:
+        cmap = font.getBestCmap() or {}
+    finally:
+        font.close()
+    return np.array(sorted(cmap), dtype=np.uint32)
+
+
+def get_glyph_coverage(font_path: str) -> frozenset:
+    """
+    Return the set of code points for which a font has a glyph.
+    The cmap of each font is parsed once and cached on disk, keyed by the font
+    path and modification time, so that it is shared by all processes.
+    """
+
+    coverage = _glyph_coverages.get(font_path)
+    if coverage is not None:
+        return coverage
+
+    try:
+        font_path_abs = os.path.abspath(font_path)
+        key = "{}:{}".format(font_path_abs, os.stat(font_path_abs).st_mtime_ns)
+        cache_dir = os.path.join(get_cache_dir(), "glyphs")
+        cache_path = os.path.join(
+            cache_dir, hashlib.sha1(key.encode("utf8")).hexdigest() + ".npy"
+        )
+        try:
+            codepoints = np.load(cache_path)
+        except (OSError, ValueError):
+            codepoints = _read_glyph_coverage(font_path_abs)
+            temp_path = None
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+                    temp_path = f.name
+                    np.save(f, codepoints)
+                os.replace(temp_path, cache_path)
+                temp_path = None
+            except OSError:
+                # The cache is an optimization, a read-only location is fine
+                pass
+            finally:
+                if temp_path is not None:
+                    try:
+                        os.remove(temp_path)
+                    except OSError:
+                        pass
+        coverage = frozenset(codepoints.tolist())
+    except Exception:
+        coverage = frozenset()
+
+    _glyph_coverages[font_path] = coverage
+    return coverage
+
+
 def font_has_glyph(font_path: str, char: str) -> bool:
     """
     Check whether a font contains a glyph for a given character.
     """
     try:
-        font = TTFont(font_path)
-        cmap = font.getBestCmap()
-        return ord(char) in cmap
-    except Exception:
+        return ord(char) in get_glyph_coverage(font_path)
+    except TypeError:
+        # Not a single character
         return False
-    finally:
-        try:
-            font.close()
-        except Exception:
-            pass
 
 
 def filter_fonts_for_text(text: str, fonts: List[str]) -> List[str]:
     """
     Filter a list of fonts, returning those that support all characters in the text.
     """
-    required_chars = set(text)
-    return [f for f in fonts if all(font_has_glyph(f, c) for c in required_chars)]
+    required_codepoints = {ord(c) for c in text}
+    return [f for f in fonts if required_codepoints <= get_glyph_coverage(f)]
+
+
+def iterate_bounded(iterable: Iterable, semaphore, stop=None) -> Iterator:
+    """
+    Yield the items of iterable, acquiring semaphore before each one. The
+    consumer releases it once an item is done, which bounds the number of items
+    in flight when iterable is fed to a multiprocessing Pool.
+
+    A consumer that gives up sets the stop event and releases semaphore, so
+    that the thread feeding the Pool returns instead of waiting forever.
+    """
+    for item in iterable:
+        semaphore.acquire()
+        if stop is not None and stop.is_set():
+            return
+        yield item
+
+
+def sample_rng(seed: int, index: int, stream: int = 0) -> random.Random:
+    """
+    Random generator of the sample at index in a run seeded with seed. It only
+    depends on the pair, so any sample can be generated again on its own, in
+    any process and in any order. Other streams give independent generators of
+    the same sample, e.g. to draw its text apart from its rendering.
+    """
+    entropy = [seed, index] if stream == 0 else [seed, index, stream]
+    state = np.random.SeedSequence(entropy).generate_state(4)
+    return random.Random(int.from_bytes(state.tobytes(), "little"))
+
+
+# uint8 images (N x H x W x C, zero padded on the right), their widths (more
+# than W for the images cropped to fit, see paste_array), their labels encoded
+# by encode_labels and the label lengths
+ArrayBatch = namedtuple("ArrayBatch", ["images", "widths", "labels", "label_lengths"])
+
+
+def array_buffer(
+    buffer: np.ndarray, batch_size: int, height: int, width: int, image_mode: str
+) -> np.ndarray:
+    """
+    Return buffer if it can hold a batch of images of that shape and mode, a
+    new uint8 array otherwise
+    """
+    shape = (batch_size, height, width, Image.getmodebands(image_mode))
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, dtype=np.uint8)
+    return buffer
+
+
+def paste_array(image: Image, out: np.ndarray) -> int:
+    """
+    Copy image into out, an H x W x C uint8 array, and zero the rest. The
+    image is resized to H pixels high, keeping its aspect ratio, and cropped
+    to its first W columns if it is wider. Return its resized width, which is
+    more than W for a cropped image.
+    """
+    height, max_width = out.shape[:2]
+    width = max(1, round(image.size[0] * height / image.size[1]))
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.Resampling.BILINEAR)
+    pixels = np.asarray(image).reshape(height, width, -1)[:, :max_width]
+    out[:, : pixels.shape[1]] = pixels
+    out[:, pixels.shape[1] :] = 0
+    return width
+
+
+def encode_labels(
+    labels: List[str], charset: str = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encode labels as an N x longest label int32 array, padded with 0, and
+    return it with their lengths. Characters are their index in charset plus 1,
+    which leaves 0 for the CTC blank, or their code point without charset.
+    """
+    lengths = np.array([len(label) for label in labels], dtype=np.int32)
+    encoded = np.zeros((len(labels), lengths.max(initial=0)), dtype=np.int32)
+    codes = None if charset is None else {c: i + 1 for i, c in enumerate(charset)}
+    for i, label in enumerate(labels):
+        if codes is None:
+            encoded[i, : len(label)] = [ord(c) for c in label]
+        else:
+            try:
+                encoded[i, : len(label)] = [codes[c] for c in label]
+            except KeyError as e:
+                raise ValueError(
+                    "Character {!r} of {!r} is not in the charset".format(
+                        e.args[0], label
+                    )
+                )
+    return encoded, lengths
@@ -0,0 +1,271 @@
+"""
+Sentences of random Wikipedia pages, fetched concurrently and kept in an on-disk
+cache per language that later runs draw from
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random as rnd
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from trdg.utils import get_cache_dir
+
+# {lang} is replaced by the language, TRDG_WIKIPEDIA_URL overrides it
+DEFAULT_WIKIPEDIA_URL = "https://{lang}.wikipedia.org"
+RANDOM_SUMMARY_PATH = "/api/rest_v1/page/random/summary"
+USER_AGENT = "trdg (https://github.com/Belval/TextRecognitionDataGenerator)"
+
+# Statuses worth another try, the other errors are raised at once
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Sentences kept in the cache of a language, the oldest ones are dropped
+MAX_CACHED_SENTENCES = 200000
+
+# Cache file -> ((mtime, size) of the file, its sentences, {minimum_length:
+# sentences of more words}), so that draws only read the file when it changes
+_loaded = {}
+
+
+def random_summary_url(lang: str, base_url: str = None) -> str:
+    """URL of the summary of a random page of the Wikipedia of lang"""
+    if base_url is None:
+        base_url = os.environ.get("TRDG_WIKIPEDIA_URL", DEFAULT_WIKIPEDIA_URL)
+    return base_url.format(lang=lang).rstrip("/") + RANDOM_SUMMARY_PATH
+
+
+def _get_json(url: str, timeout: float) -> dict:
+    request = urllib.request.Request(
+        url, headers={"User-Agent": USER_AGENT, "Accept": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf8"))
+
+
+async def _fetch_summary(
+    url: str, semaphore: asyncio.Semaphore, retries: int, backoff: float, timeout: float
+) -> str:
+    """Summary of a random page, None for a disambiguation or empty page"""
+    loop = asyncio.get_running_loop()
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                page = await loop.run_in_executor(None, _get_json, url, timeout)
+            break
+        except urllib.error.HTTPError as e:
+            if e.code not in RETRY_STATUSES or attempt == retries:
+                raise
+        except OSError:
+            # Connection errors and timeouts
+            if attempt == retries:
+                raise
+        await asyncio.sleep(backoff * 2 ** attempt)
+
+    if page.get("type") == "disambiguation":
+        return None
+    return page.get("extract") or None
+
+
+async def fetch_summaries(
+    lang: str,
+    count: int,
+    concurrency: int = 8,
+    retries: int = 3,
+    backoff: float = 0.5,
+    timeout: float = 10.0,
+    base_url: str = None,
+) -> List[str]:
+    """
+    Fetch the summaries of at least count random pages, with at most
+    concurrency requests at a time. Failed requests are retried after backoff
+    seconds, doubled on every attempt, and disambiguation pages are replaced.
+    Pages that still fail are left out, the error is only raised if no page
+    could be fetched at all.
+    """
+
+    url = random_summary_url(lang, base_url)
+    semaphore = asyncio.Semaphore(concurrency)
+    summaries = []
+    while len(summaries) < count:
+        results = await asyncio.gather(
+            *[
+                _fetch_summary(url, semaphore, retries, backoff, timeout)
+                for _ in range(max(count - len(summaries), concurrency))
+            ],
+            return_exceptions=True,
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        found = [r for r in results if isinstance(r, str)]
+        if len(errors) > 0:
+            print(
+                "{} Wikipedia pages could not be fetched: {}".format(
+                    len(errors), errors[0]
+                )
+            )
+            if len(summaries) + len(found) == 0:
+                raise errors[0]
+        # Not a single page out of concurrency or more
+        if len(found) == 0:
+            break
+        summaries.extend(found)
+    return summaries
+
+
+def _run(coroutine):
+    """Run a coroutine to completion, even from a thread with a running loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # Notebooks run an event loop in the main thread
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def split_sentences(summary: str) -> List[str]:
+    return [s.strip() for s in summary.replace("\n", " ").split(". ") if s.strip()]
+
+
+def sentence_cache_path(lang: str) -> str:
+    return os.path.join(get_cache_dir(), "wikipedia", lang + ".txt")
+
+
+def _load(lang: str):
+    """Entry of _loaded of the cache of lang, read again if the file changed"""
+    path = sentence_cache_path(lang)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (None, [], {})
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    entry = _loaded.get(path)
+    if entry is None or entry[0] != stamp:
+        with open(path, "r", encoding="utf8") as f:
+            sentences = list(dict.fromkeys(line.rstrip("\n") for line in f))
+        entry = _loaded[path] = (stamp, sentences, {})
+    return entry
+
+
+def load_cached_sentences(lang: str) -> List[str]:
+    """Sentences in the cache of lang, without duplicates"""
+    return list(_load(lang)[1])
+
+
+def add_cached_sentences(lang: str, sentences: List[str]) -> List[str]:
+    """
+    Add the sentences that are not in the cache of lang yet, dropping the
+    oldest ones beyond MAX_CACHED_SENTENCES. Return the added sentences.
+    """
+    path = sentence_cache_path(lang)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    stamp, cached, _ = _load(lang)
+    known = set(cached)
+    new = [s for s in dict.fromkeys(sentences) if s not in known]
+    if len(new) == 0:
+        return new
+    if len(cached) + len(new) > MAX_CACHED_SENTENCES:
+        sentences = (cached + new)[-MAX_CACHED_SENTENCES:]
+        data = "".join(s + "\n" for s in sentences)
+        size = len(data.encode("utf8"))
+        # Replaced at once, so that other processes read either file
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w", encoding="utf8") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    else:
+        sentences = cached + new
+        data = "".join(s + "\n" for s in new)
+        size = (stamp[1] if stamp is not None else 0) + len(data.encode("utf8"))
+        # A single appending write, so that processes sharing the cache do not
+        # interleave their lines
+        with open(path, "a", encoding="utf8") as f:
+            f.write(data)
+    stat = os.stat(path)
+    # Unless another process wrote to it too, the file holds these sentences
+    if stat.st_size == size:
+        _loaded[path] = ((stat.st_mtime_ns, stat.st_size), sentences, {})
+    return new
+
+
+def fetch_sentences(lang: str, pages: int, **kwargs) -> List[str]:
+    """
+    Fetch the summaries of pages random pages, see fetch_summaries, and add
+    their sentences to the cache of lang. Return the sentences it did not
+    hold yet.
+    """
+    summaries = _run(fetch_summaries(lang, pages, **kwargs))
+    sentences = [s for summary in summaries for s in split_sentences(summary)]
+    return add_cached_sentences(lang, sentences)
+
+
+def draw_sentences(
+    lang: str, minimum_length: int, count: int, rng: rnd.Random = rnd
+) -> List[str]:
+    """
+    Draw count sentences of more than minimum_length words from the cache of
+    lang, fetching new pages until there are enough of them. Raise a
+    RuntimeError if a fetch brings no new one.
+    """
+
+    _, sentences, by_length = _load(lang)
+    if minimum_length not in by_length:
+        by_length[minimum_length] = [
+            s for s in sentences if len(s.split()) > minimum_length
+        ]
+    candidates = by_length[minimum_length]
+    if len(candidates) < count:
+        # Kept here rather than read back from the cache, which may drop some
+        # of them to stay under MAX_CACHED_SENTENCES
+        candidates = list(candidates)
+        known = set(candidates)
+    while len(candidates) < count:
+        # Most summaries hold a few sentences, not all of them long enough
+        new = [
+            s
+            for s in fetch_sentences(lang, min(64, count - len(candidates)))
+            if len(s.split()) > minimum_length and s not in known
+        ]
+        if len(new) == 0:
+            raise RuntimeError(
+                "Only {} sentences of more than {} words could be fetched from "
+                "Wikipedia, {} are needed".format(
+                    len(candidates), minimum_length, count
+                )
+            )
+        candidates.extend(new)
+        known.update(new)
+    return rng.sample(candidates, count)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fill the Wikipedia sentence cache used by -wk, --use_wikipedia"
+    )
+    parser.add_argument(
+        "-l", "--language", type=str, help="Language of the Wikipedia", default="en"
+    )
+    parser.add_argument(
+        "-p", "--pages", type=int, help="Number of pages to fetch", default=1000
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        help="Number of requests at the same time",
+        default=8,
+    )
+    args = parser.parse_args()
+
+    sentences = fetch_sentences(args.language, args.pages, concurrency=args.concurrency)
+    print(
+        "Added {} sentences to {}".format(
+            len(sentences), sentence_cache_path(args.language)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Output backends of FakeTextDataGenerator: where a generated sample is written
+"""
+
+import collections
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import socket
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full
+from typing import List, Tuple
+
+from PIL import Image
+
+
+class DirectoryWriter(object):
+    """
+    Write every sample as separate files of a directory: the image, then
+    optionally [NAME]_mask.png, [NAME]_boxes.txt and [NAME].box
+    """
+
+    # Samples are written to separate files
+    thread_safe = True
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+
+    def write(
+        self,
+        index: int,
+        name: str,
+        text: str,
+        image: Image,
+        extension: str,
+        mask: Image = None,
+        bboxes: List[Tuple[int, int, int, int]] = None,
+        tess_bboxes: List[Tuple[int, int, int, int]] = None,
+    ):
+        image.save(os.path.join(self.out_dir, "{}.{}".format(name, extension)))
+        if mask is not None:
+            mask.save(os.path.join(self.out_dir, "{}_mask.png".format(name)))
+        if bboxes is not None:
+            box_path = os.path.join(self.out_dir, "{}_boxes.txt".format(name))
+            with open(box_path, "w") as f:
+                for bbox in bboxes:
+                    f.write(" ".join([str(v) for v in bbox]) + "\n")
+        if tess_bboxes is not None:
+            with open(os.path.join(self.out_dir, "{}.box".format(name)), "w") as f:
+                for bbox, char in zip(tess_bboxes, text):
+                    f.write(" ".join([char] + [str(v) for v in bbox] + ["0"]) + "\n")
+
+    def close(self):
+        pass
+
+
+class TarShardWriter(object):
+    """
+    Append samples to tar shards in the WebDataset layout: the members of a
+    sample share the key [INDEX], with [INDEX].[EXT] for the image,
+    [INDEX].json for the label and boxes and [INDEX].mask.png for the mask.
+
+    A shard is closed once it holds max_bytes and the next one is started.
+    Shards are named [PREFIX]-[PID]-[NUMBER].tar so that every process can
+    write its own without any locking, and only get their final name once
+    they are complete.
+    """
+
+    def __init__(self, out_dir: str, max_bytes: int = 256 << 20, prefix: str = None):
+        self.out_dir = out_dir
+        self.max_bytes = max_bytes
+        self.prefix = socket.gethostname() if prefix is None else prefix
+        self.shard_count = 0
+        self.shard_paths = []
+        self._tar = None
+        self._path = None
+
+    def _open_shard(self):
+        self._path = os.path.join(
+            self.out_dir,
+            "{}-{}-{:06d}.tar".format(self.prefix, os.getpid(), self.shard_count),
+        )
+        self._tar = tarfile.open(self._path + ".part", "w")
+        self.shard_count += 1
+
+    def _close_shard(self):
+        self._tar.close()
+        os.replace(self._path + ".part", self._path)
+        self.shard_paths.append(self._path)
+        self._tar = None
+
+    def _add(self, member_name: str, data: bytes):
+        info = tarfile.TarInfo(member_name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def write(
+        self,
+        index: int,
+        name: str,
+        text: str,
+        image: Image,
+        extension: str,
+        mask: Image = None,
+        bboxes: List[Tuple[int, int, int, int]] = None,
+        tess_bboxes: List[Tuple[int, int, int, int]] = None,
+    ):
+        if self._tar is None:
+            self._open_shard()
+
+        key = "{:09d}".format(index)
+        self._add("{}.{}".format(key, extension), encode_image(image, extension))
+
+        annotation = {"label": text}
+        if bboxes is not None:
+            annotation["bboxes"] = [list(bbox) for bbox in bboxes]
+        if tess_bboxes is not None:
+            annotation["tess_bboxes"] = [
+                [char] + list(bbox) for bbox, char in zip(tess_bboxes, text)
+            ]
+        self._add(
+            "{}.json".format(key),
+            json.dumps(annotation, ensure_ascii=False).encode("utf8"),
+        )
+
+        if mask is not None:
+            self._add("{}.mask.png".format(key), encode_image(mask, "png"))
+
+        if self._tar.fileobj.tell() >= self.max_bytes:
+            self._close_shard()
+
+    def close(self):
+        if self._tar is not None:
+            self._close_shard()
+
+
+def encode_image(image: Image, extension: str) -> bytes:
+    """Encode an image in memory in the format of its file extension"""
+    data = io.BytesIO()
+    image.save(data, format=Image.registered_extensions()["." + extension])
+    return data.getvalue()
+
+
+def encode_lmdb_record(
+    text: str,
+    image: Image,
+    extension: str,
+    mask: Image = None,
+    bboxes: List[Tuple[int, int, int, int]] = None,
+    tess_bboxes: List[Tuple[int, int, int, int]] = None,
+) -> List[Tuple[bytes, bytes]]:
+    """
+    Return the (prefix, value) pairs of a sample in the layout of CRNN style
+    LMDB datasets: image and label, then mask and bboxes when given. The
+    LmdbWriter numbers the keys, e.g. image-%09d.
+    """
+
+    record = [
+        (b"image", encode_image(image, extension)),
+        (b"label", text.encode("utf8")),
+    ]
+    if mask is not None:
+        record.append((b"mask", encode_image(mask, "png")))
+    if bboxes is not None or tess_bboxes is not None:
+        boxes = bboxes if bboxes is not None else tess_bboxes
+        record.append((b"bboxes", json.dumps([list(b) for b in boxes]).encode()))
+    return record
+
+
+class LmdbWriter(object):
+    """
+    Write samples into an LMDB database, committing them batch_size records at
+    a time. Records are numbered from 1 in the order they are written, so the
+    keys are dense and num-samples holds the last one.
+    """
+
+    def __init__(self, path: str, map_size: int = 1 << 40, batch_size: int = 1000):
+        # Only needed by this backend
+        import lmdb
+
+        self.env = lmdb.open(path, map_size=map_size)
+        self.batch_size = batch_size
+        self.count = 0
+        self._pending = []
+
+    def write(
+        self,
+        index: int,
+        name: str,
+        text: str,
+        image: Image,
+        extension: str,
+        mask: Image = None,
+        bboxes: List[Tuple[int, int, int, int]] = None,
+        tess_bboxes: List[Tuple[int, int, int, int]] = None,
+    ):
+        self.put(
+            encode_lmdb_record(text, image, extension, mask, bboxes, tess_bboxes)
+        )
+
+    def put(self, record: List[Tuple[bytes, bytes]]):
+        """Add an encoded record, see encode_lmdb_record"""
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.env.begin(write=True) as txn:
+            for key, record in enumerate(self._pending, self.count + 1):
+                for prefix, value in record:
+                    txn.put(b"%s-%09d" % (prefix, key), value)
+            self.count += len(self._pending)
+            txn.put(b"num-samples", str(self.count).encode())
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self.env.close()
+
+
+class QueueWriter(object):
+    """
+    Encode samples in the current process and send them to the process of a
+    LmdbWriterProcess. Writing blocks while its queue is full, and raises if
+    the process stopped in the meantime.
+    """
+
+    thread_safe = True
+
+    def __init__(self, queue, stopped: multiprocessing.Event):
+        self.queue = queue
+        self.stopped = stopped
+
+    def write(
+        self,
+        index: int,
+        name: str,
+        text: str,
+        image: Image,
+        extension: str,
+        mask: Image = None,
+        bboxes: List[Tuple[int, int, int, int]] = None,
+        tess_bboxes: List[Tuple[int, int, int, int]] = None,
+    ):
+        record = encode_lmdb_record(
+            text, image, extension, mask, bboxes, tess_bboxes
+        )
+        while True:
+            try:
+                self.queue.put(record, timeout=1)
+                return
+            except Full:
+                if self.stopped.is_set():
+                    raise RuntimeError("The LMDB writer process stopped")
+
+    def close(self):
+        pass
+
+
+def _write_lmdb_records(queue, path: str, map_size: int, batch_size: int):
+    writer = LmdbWriter(path, map_size, batch_size)
+    try:
+        for record in iter(queue.get, None):
+            writer.put(record)
+    finally:
+        writer.close()
+
+
+class LmdbWriterProcess(object):
+    """
+    Process that owns an LMDB database and writes the records that any number
+    of processes send through a queue of at most max_pending records, see
+    queue_writer.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        map_size: int = 1 << 40,
+        batch_size: int = 1000,
+        max_pending: int = 1024,
+    ):
+        self.queue = multiprocessing.Queue(max_pending)
+        self.process = multiprocessing.Process(
+            target=_write_lmdb_records,
+            args=(self.queue, path, map_size, batch_size),
+            daemon=True,
+        )
+        self.process.start()
+        # Set when the process ends, even if it is killed, so that writers do
+        # not wait on a queue nobody reads
+        self.stopped = multiprocessing.Event()
+        threading.Thread(
+            target=LmdbWriterProcess._watch,
+            args=(self.process.sentinel, self.stopped),
+            daemon=True,
+        ).start()
+
+    @staticmethod
+    def _watch(sentinel, stopped: multiprocessing.Event):
+        multiprocessing.connection.wait([sentinel])
+        stopped.set()
+
+    def queue_writer(self) -> QueueWriter:
+        return QueueWriter(self.queue, self.stopped)
+
+    def close(self):
+        """Write the records still in the queue and wait for the process"""
+        self.queue.put(None)
+        self.process.join()
+        if self.process.exitcode != 0:
+            raise RuntimeError("The LMDB writer process failed")
+
+
+class AsyncWriter(object):
+    """
+    Hand the samples to another writer from a pool of threads, so that they
+    are encoded and saved while the next ones are rendered. Writers without a
+    thread_safe attribute are only called by one thread at a time.
+
+    At most max_pending samples wait to be written, write blocks beyond that.
+    The first error of a write is raised by one of the next calls to write or
+    by close, which waits for the pending samples and closes the writer.
+    """
+
+    def __init__(self, writer, threads: int = 2, max_pending: int = None):
+        self.writer = writer
+        self.max_pending = 2 * threads if max_pending is None else max_pending
+        self._executor = ThreadPoolExecutor(threads)
+        self._pending = collections.deque()
+        self._lock = None
+        if not getattr(writer, "thread_safe", False):
+            self._lock = threading.Lock()
+
+    def _write(self, args):
+        if self._lock is None:
+            self.writer.write(*args)
+        else:
+            with self._lock:
+                self.writer.write(*args)
+
+    def _wait(self, max_pending: int):
+        """Collect the completed writes and the oldest ones beyond max_pending"""
+        while self._pending and (
+            self._pending[0].done() or len(self._pending) > max_pending
+        ):
+            self._pending.popleft().result()
+
+    def write(
+        self,
+        index: int,
+        name: str,
+        text: str,
+        image: Image,
+        extension: str,
+        mask: Image = None,
+        bboxes: List[Tuple[int, int, int, int]] = None,
+        tess_bboxes: List[Tuple[int, int, int, int]] = None,
+    ):
+        self._wait(self.max_pending - 1)
+        args = (index, name, text, image, extension, mask, bboxes, tess_bboxes)
+        self._pending.append(self._executor.submit(self._write, args))
+
+    def flush(self):
+        """Wait until every pending sample is written"""
+        self._wait(0)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+            self.writer.close()